@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""Benchmark of archive codecs.
+
+Builds archives of files of a nest with every available codec (the way
+`pake.nest.package.build()` does, see `pake.nest.incremental.writearchive()`),
+with and without the build cache, and reports build time, archive size and
+decompression time.
+A plain tar stream compressed by the codec's writer is reported as a reference.
+
+Usage:
+
+    python3 ./bench/codecs.py [NEST] [CODEC[:LEVEL] ...]
+
+NEST is a path to .pakenest directory (files listed in its files.json are used);
+by default files of PAKE itself are archived.
+By default every available codec is benchmarked at its default level, and
+xz additionally at level 9e.
+"""
+
+
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pake import config  # noqa: E402
+from pake.nest import compress, incremental  # noqa: E402
+
+
+def getfiles(nest=None):
+    if nest is not None: return [os.path.normpath(i) for i in config.nest.Files(nest)]
+    files = []
+    for directory in ['./pake', './ui', './doc']:
+        for path, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [d for d in dirnames if d != '__pycache__']
+            files.extend([os.path.normpath(os.path.join(path, f)) for f in filenames])
+    return sorted(files)
+
+
+def buildplain(path, files, codec, level):
+    ofstream = open(path, 'wb')
+    writer = compress.getcodec(codec).writer(ofstream, level=level)
+    package = tarfile.open(fileobj=writer, mode='w|', format=tarfile.GNU_FORMAT)
+    for f in files: package.add(f, recursive=False)
+    package.close()
+    writer.close()
+    ofstream.close()
+
+
+def bench(files, codec, level, mode):
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'build.tar')
+        start = time.perf_counter()
+        if mode == 'plain': buildplain(path, files, codec, level)
+        else: incremental.writearchive(root, path, files, codec=codec, level=level, cache=(mode == 'cache'))
+        built = time.perf_counter() - start
+        ifstream = open(path, 'rb')
+        data = ifstream.read()
+        ifstream.close()
+    finally:
+        shutil.rmtree(root)
+    size = len(data)
+
+    start = time.perf_counter()
+    reader = compress.getcodec(codec).reader(io.BytesIO(data))
+    package = tarfile.open(fileobj=reader, mode='r|')
+    for member in package:
+        if member.isfile(): package.extractfile(member).read()
+    package.close()
+    decompressed = time.perf_counter() - start
+    return (built, size, decompressed)
+
+
+def main(args):
+    nest = None
+    if args and os.path.isdir(args[0]): nest = args.pop(0)
+    runs = [tuple((i.split(':', 1) + [None])[:2]) for i in args]
+    if not runs: runs = [(name, None) for name in compress.available()] + [('xz', '9e')]
+    files = getfiles(nest)
+    total = sum([os.path.getsize(f) for f in files])
+    print('{0} files, {1} bytes'.format(len(files), total))
+    header = ('codec', 'mode', 'build [s]', 'size [B]', 'ratio', 'extract [s]')
+    print('{0:<10} {1:<8} {2:>10} {3:>12} {4:>8} {5:>12}'.format(*header))
+    for codec, level in runs:
+        name = (codec if level is None else '{0}:{1}'.format(codec, level))
+        for mode in ['plain', 'nocache', 'cache']:
+            built, size, decompressed = bench(files, codec, level, mode)
+            ratio = size / max(total, 1)
+            row = (name, mode, built, size, ratio, decompressed)
+            print('{0:<10} {1:<8} {2:>10.3f} {3:>12} {4:>8.3f} {5:>12.3f}'.format(*row))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -10,6 +10,7 @@ from . import transactions
 from . import config
 from . import shared
 from . import errors
+from . import records
 
 
 __version__ = '0.1.2'
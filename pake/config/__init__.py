@@ -5,3 +5,5 @@
 from . import node
 from . import nest
 from . import base
+from . import session
+from . import sqlite
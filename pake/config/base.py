@@ -5,10 +5,249 @@
 """
 
 
+import contextlib
+import copy
 import json
 import os
+import threading
+import time
 import warnings
 
+try:
+    import fcntl
+except ImportError:
+    # advisory locking is not available on this platform
+    fcntl = None
+
+
+# suffix of journals of config files
+JOURNAL = '.journal'
+
+
+# in-process cache of decoded config files
+# path -> (stamp, content) where stamp is (st_mtime_ns, st_size) of the file
+# and its journal at the moment it was read; content is shared between all
+# Config objects that hit the cache and is copied on first modification
+_cache = {}
+_cachelock = threading.Lock()
+_cachestats = {'hits': 0, 'misses': 0}
+
+
+def _stamp(path):
+    """Returns (st_mtime_ns, st_size) two-tuple for given path.
+    Returns None if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+    return stamp
+
+
+# advisory locks of config files
+# path -> _FileLock, lock files are named .<name>.lock and placed next to config files
+_locks = {}
+_lockslock = threading.Lock()
+_lockstats = {'acquired': 0, 'waits': 0, 'waited': 0.0, 'maxwait': 0.0}
+
+
+class _FileLock():
+    """Shared/exclusive lock of a config file.
+    Lock is held by at most one thread of the process at a time
+    (and is reentrant for that thread), and by any number of processes in shared
+    mode or by one process in exclusive mode.
+    """
+    def __init__(self, path):
+        self.path = os.path.join(os.path.dirname(path), '.{0}.lock'.format(os.path.basename(path)))
+        self._mutex = threading.RLock()
+        self._fd = None
+        self._exclusive = False
+        self._depth = 0
+
+    def _record(self, waited):
+        with _lockslock:
+            _lockstats['acquired'] += 1
+            if waited:
+                _lockstats['waits'] += 1
+                _lockstats['waited'] += waited
+                _lockstats['maxwait'] = max(_lockstats['maxwait'], waited)
+
+    def _flock(self, exclusive):
+        mode = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            fcntl.flock(self._fd, mode | fcntl.LOCK_NB)
+        except BlockingIOError:
+            start = time.monotonic()
+            fcntl.flock(self._fd, mode)
+            return time.monotonic() - start
+        return 0.0
+
+    def acquire(self, exclusive=False):
+        waited = 0.0
+        if not self._mutex.acquire(blocking=False):
+            # lock is held by other thread of this process
+            start = time.monotonic()
+            self._mutex.acquire()
+            waited = time.monotonic() - start
+        try:
+            if self._depth == 0 and fcntl is not None:
+                try:
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+                except (FileNotFoundError, PermissionError):
+                    # directory is missing or read-only, there is nothing to protect
+                    self._fd = None
+            if self._fd is not None and (self._depth == 0 or (exclusive and not self._exclusive)):
+                waited += self._flock(exclusive)
+                self._exclusive = (self._exclusive or exclusive)
+        except BaseException:
+            if self._depth == 0 and self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            self._mutex.release()
+            raise
+        self._depth += 1
+        if self._depth == 1: self._record(waited)
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            # closing the descriptor releases the lock
+            os.close(self._fd)
+            self._fd, self._exclusive = None, False
+        self._mutex.release()
+
+
+@contextlib.contextmanager
+def locked(path, exclusive=True):
+    """Context manager holding advisory lock of config file in given path.
+
+    :param path: path to config file
+    :param exclusive: whether to take exclusive (write) or shared (read) lock
+    """
+    # the same file may be reached through different (relative, absolute, symlinked) paths
+    path = os.path.realpath(path)
+    with _lockslock:
+        if path not in _locks: _locks[path] = _FileLock(path)
+        lock = _locks[path]
+    lock.acquire(exclusive)
+    try:
+        yield lock
+    finally:
+        lock.release()
+
+
+def lockstats():
+    """Returns dictionary with lock metrics:
+
+        * acquired: number of acquired locks,
+        * waits:    number of locks that were not acquired immediately,
+        * waited:   total time spent waiting for locks (in seconds),
+        * maxwait:  longest wait for a lock (in seconds),
+    """
+    with _lockslock:
+        stats = dict(_lockstats)
+    return stats
+
+
+def _stamps(path):
+    """Returns two-tuple of stamps of config file and its journal.
+    """
+    return (_stamp(path), _stamp(path + JOURNAL))
+
+
+def _replay(path, content):
+    """Applies records from journal in given path to content.
+
+    Journal is a file with one JSON-encoded record per line:
+
+        {"s": key, "v": value}      # key was set to value
+        {"d": key}                  # key was removed
+
+    :param path: path to the journal
+    :param content: decoded snapshot of config file
+    """
+    ifstream = open(path)
+    lines = ifstream.read().splitlines()
+    ifstream.close()
+    for n, line in enumerate(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # last record may be cut if the process writing it was killed
+            warnings.warn('{0}: skipping invalid record in line {1}'.format(path, n+1))
+            continue
+        if 's' in record: content[record['s']] = record['v']
+        elif record['d'] in content: del content[record['d']]
+    return content
+
+
+def cachestats():
+    """Returns dictionary with read cache hit and miss counters.
+    """
+    with _cachelock:
+        stats = dict(_cachestats)
+    return stats
+
+
+def clearcache():
+    """Drops all cached config files and resets counters.
+    """
+    with _cachelock:
+        _cache.clear()
+        for key in _cachestats: _cachestats[key] = 0
+
+
+def invalidate(path):
+    """Drops cached content of given config file.
+    """
+    with _cachelock:
+        if path in _cache: del _cache[path]
+
+
+def encode(content, pretty=False):
+    """Encodes content of config file as JSON.
+
+    :param pretty: enable pretty formating of JSON
+    """
+    if pretty: encoded = json.dumps(content, sort_keys=True, indent=4, separators=(',', ': '))
+    else: encoded = json.dumps(content)
+    return encoded
+
+
+def _writeatomic(path, data, fsync=True):
+    """Writes data to a temporary file in the directory of the path and
+    atomically renames it to the path so readers never see partially written files.
+
+    :param path: path to the target file
+    :param data: string to write
+    :param fsync: flush data (and the rename) to disk before returning
+    """
+    directory = os.path.dirname(path) or '.'
+    tmp = os.path.join(directory, '.{0}.{1}.{2}.tmp'.format(os.path.basename(path), os.getpid(), threading.get_ident()))
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+    try:
+        with open(fd, 'w') as ofstream:
+            ofstream.write(data)
+            ofstream.flush()
+            if fsync: os.fsync(ofstream.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp): os.remove(tmp)
+        raise
+    if fsync:
+        try:
+            dirfd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            # some platforms do not allow opening directories
+            return
+        try:
+            os.fsync(dirfd)
+        except OSError:
+            pass
+        finally:
+            os.close(dirfd)
+
 
 class Config():
     """Base object for config files interfaces.
@@ -17,14 +256,43 @@ class Config():
 
     This base config object can be modified in-place but also
     provides a fluent API which is in some cases much more useful.
+
+    Config objects remember whether they were modified since they were
+    read and `write()` is a no-op for unmodified ones.
+    Files are written atomically (to temporary file that is then renamed) and,
+    if `fsync` is True, flushed to disk.
+
+    Config files are read lazily - on first access to content.
+    Configs that are reset before being accessed are never read.
+    Decoded content is shared with the read cache (and other config objects), so values
+    returned by getters and `content` must not be modified in place; callers that
+    need to change them must copy them first (e.g. `dict(deps.get(name))`).
+
+    Configs with dictionary content may be journaled (set `journaled` to True).
+    Changes made to journaled configs are appended to a journal file (`<name>.journal`)
+    instead of rewriting whole file, and are folded back into the file
+    when the journal grows over `journalthreshold` bytes (or when `compact()`
+    is called).  Existing journals are always replayed when reading.
+
+    Reads and writes take shared and exclusive advisory locks (fcntl.flock()) of
+    the config file so concurrent processes working on the same node do not
+    see partial changes.
     """
     name = 'base.json'
     default = {}
-    content = {}
+    fsync = True
+    journaled = False
+    journalthreshold = 256 * 1024
 
     def __init__(self, root):
         self.root = root
-        self.read()
+        self._content = None
+        self._unread = True
+        self._shared, self._copied = False, None
+        self._dirty = False
+        self._stamp = None
+        self._touched, self._whole = set(), False
+        self._loaded()
 
     def __contains__(self, key):
         return key in self.content
@@ -38,47 +306,176 @@ class Config():
     def __list__(self):
         return list(self.content)
 
+    @property
+    def content(self):
+        """Decoded content of the config file.
+        """
+        if self._unread: self.read()
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._unread = False
+
+    def _loaded(self):
+        """Called every time content is replaced as a whole (after reading or resetting).
+        Subclasses that keep indexes of content should drop them here.
+        """
+        pass
+
+    def _modify(self, key=None):
+        """Must be called by every method before it modifies content in place.
+        If the content is shared with read cache it is copied first so
+        other config objects (and the cache) do not see the change.
+
+        Only the dictionary itself and the value of modified key are copied when the key is given;
+        values of other keys remain shared until they are modified.
+
+        :param key: key of content that will be modified, None if it's not known (or content is not a dictionary)
+        """
+        if self._unread: self.read()
+        if self._shared:
+            if key is None or not isinstance(self.content, dict): self.content = copy.deepcopy(self.content)
+            else: self.content, self._copied = dict(self.content), set()
+            self._shared = False
+        if self._copied is not None:
+            unshared = ([key] if key is not None else list(self.content))
+            for k in unshared:
+                if k in self.content and k not in self._copied: self.content[k] = copy.deepcopy(self.content[k])
+            self._copied.update(unshared)
+            if key is None: self._copied = None
+        self._dirty = True
+        if key is None: self._whole = True
+        else: self._touched.add(key)
+
+    def _clean(self, path):
+        """Marks config as unmodified and puts its content in read cache.
+        """
+        self._dirty, self._stamp = False, _stamps(path)
+        self._touched, self._whole = set(), False
+        with _cachelock: _cache[path] = (self._stamp, self.content)
+        self._shared, self._copied = True, None
+
+    def modified(self):
+        """Returns True if the config was modified since it was last read or written.
+        """
+        return self._dirty
+
     def reset(self):
         """Resets config file to it's default value.
         """
-        self.content = self.default
+        self.content = copy.deepcopy(self.default)
+        self._shared, self._copied = False, None
+        self._dirty = True
+        self._whole = True
+        self._loaded()
         return self
 
     def read(self):
         """Reads JSON from config file.
+        Decoded content is cached per process and reused for as long as
+        modification time and size of the file (and its journal) do not change.
         """
-        reraise = False
-        try:
-            ifstream = open(os.path.join(self.root, self.name))
-            content = json.loads(ifstream.read())
-            ifstream.close()
-        except FileNotFoundError:
-            content = self.default
-        except ValueError as e:
-            warnings.warn(e)
-            print('the content read was:')
-            print(content)
-            content = self.default
-        except (Exception) as e:
-            # set reraise flag to True so any exception that is not handled before will be reraised
-            reraise = e
-        finally:
-            if reraise: raise reraise
-            self.content = content
+        path = os.path.join(self.root, self.name)
+        stamp = _stamps(path)
+        self._dirty, self._stamp = False, stamp
+        self._touched, self._whole = set(), False
+        with _cachelock:
+            cached = _cache.get(path)
+            if stamp != (None, None) and cached is not None and cached[0] == stamp:
+                _cachestats['hits'] += 1
+                self.content, self._shared, self._copied = cached[1], True, None
+                self._loaded()
+                return self
+            _cachestats['misses'] += 1
+        shared = False
+        with locked(path, exclusive=False):
+            # file could have been changed before lock was acquired
+            stamp = _stamps(path)
+            self._stamp = stamp
+            try:
+                ifstream = open(path)
+                content = ifstream.read()
+                ifstream.close()
+                content = json.loads(content)
+                shared = True
+            except FileNotFoundError:
+                content = copy.deepcopy(self.default)
+            except ValueError as e:
+                warnings.warn('{0}: {1}'.format(path, e))
+                content = copy.deepcopy(self.default)
+            if stamp[1] is not None:
+                content = _replay(path + JOURNAL, content)
+                shared = True
+        if shared:
+            with _cachelock: _cache[path] = (stamp, content)
+        self.content, self._shared, self._copied = content, shared, None
+        self._loaded()
         return self
 
-    def write(self, root='', pretty=False):
+    def _journal(self, path, fsync):
+        """Appends changes to the journal of config file.
+        """
+        records = []
+        for key in self._touched:
+            if key in self.content: record = {'s': key, 'v': self.content[key]}
+            else: record = {'d': key}
+            records.append(json.dumps(record, separators=(',', ':')))
+        ofstream = open(path + JOURNAL, 'a')
+        ofstream.write(''.join([r + '\n' for r in records]))
+        ofstream.flush()
+        if fsync: os.fsync(ofstream.fileno())
+        ofstream.close()
+        invalidate(path)
+        self._clean(path)
+
+    def write(self, root='', pretty=False, fsync=None, force=False):
         """Stores changes made to config file.
+        Nothing is written if the config was not modified (unless pretty formatting
+        is requested, a different root is given or write is forced); in particular
+        an unmodified config never overwrites changes made to the file by other processes.
 
         :param pretty: enable pretty formating of JSON
         :param path: path to the root
+        :param fsync: override `fsync` class attribute for this write
+        :param force: write even if config was not modified
         """
+        own = (not root or root == self.root)
         if not root: root = self.root
-        ofstream = open(os.path.join(root, self.name), 'w')
-        if pretty: encoded = json.dumps(self.content, sort_keys=True, indent=4, separators=(',', ': '))
-        else: encoded = json.dumps(self.content)
-        ofstream.write(encoded)
-        ofstream.close()
+        path = os.path.join(root, self.name)
+        if own and not pretty and not force and not self._dirty: return self
+        if fsync is None: fsync = self.fsync
+        stamped = (self._stamp is not None and self._stamp[0] is not None)
+        journal = (own and not pretty and not force and self.journaled and not self._whole and stamped)
+        journal = (journal and isinstance(self.content, dict))
+        with locked(path, exclusive=True):
+            if journal:
+                self._journal(path, fsync)
+                if self._stamp[1][1] < self.journalthreshold: return self
+            _writeatomic(path, encode(self.content, pretty), fsync=fsync)
+            invalidate(path)
+            if own:
+                # snapshot contains all changes from journal
+                if os.path.exists(path + JOURNAL): os.remove(path + JOURNAL)
+                self._clean(path)
+        return self
+
+    def locked(self, exclusive=True):
+        """Returns context manager holding advisory lock of the config file.
+        Reads and writes take short locks on their own; this is needed only
+        to make read-modify-write sequences atomic with respect to other processes:
+
+            with config.locked():
+                config.read().set(key, value).write()
+        """
+        return locked(os.path.join(self.root, self.name), exclusive=exclusive)
+
+    def compact(self, fsync=None):
+        """Folds journal of config file (if it's present) back into the file.
+        """
+        path = os.path.join(self.root, self.name)
+        if os.path.exists(path + JOURNAL): self.write(force=True, fsync=fsync)
         return self
 
 
@@ -93,17 +490,18 @@ class Meta(Config):
     """
     name = 'meta.json'
     default = {}
-    content = {}
 
     def set(self, key, value):
         """Sets key in metadata. Part of PAKE fluent API.
         """
+        self._modify(key)
         self.content[key] = value
         return self
 
     def remove(self, key):
         """Removes key from metadata. Part of PAKE fluent API.
         """
+        self._modify(key)
         del self.content[key]
         return self
 
@@ -11,6 +11,7 @@ import pyversion
 
 from . import base
 from .. import errors
+from ..nest import scanner
 
 
 class Meta(base.Meta):
@@ -34,7 +35,6 @@ class Versions(base.Config):
     """
     name = 'versions.json'
     default = []
-    content = []
 
     def add(self, version, check=False, strict=True):
         """Adds new version to a list of versions.
@@ -56,6 +56,7 @@ class Versions(base.Config):
                 last_is_greater = False
             if check and last_is_greater:
                 raise ValueError('{0} is lesser version then the last present: {1}'.format(version, self[-1]))
+            self._modify()
             self.content.append(version)
         return self
 
@@ -64,7 +65,9 @@ class Versions(base.Config):
 
         :param version: version string to remove
         """
-        if version in self: self.content.remove(version)
+        if version in self:
+            self._modify()
+            self.content.remove(version)
         return self
 
 
@@ -75,7 +78,6 @@ class Dependencies(base.Config):
     """
     name = 'dependencies.json'
     default = {}
-    content = {}
 
     def set(self, name, origin='', min='', max=''):
         """Sets a dependency for package.
@@ -96,6 +98,7 @@ class Dependencies(base.Config):
         if origin: dep['origin'] = origin
         if min: dep['min'] = min
         if max: dep['max'] = max
+        self._modify(name)
         self.content[name] = dep
         return self
 
@@ -115,6 +118,7 @@ class Dependencies(base.Config):
         :param max: maximal allowed version
         :type max: semver-based str
         """
+        self._modify(name)
         if name in self: dep = self[name]
         else: dep = {}
         if origin: dep['origin'] = origin
@@ -126,6 +130,7 @@ class Dependencies(base.Config):
     def remove(self, name):
         """Removes a dependency.
         """
+        self._modify(name)
         del self.content[name]
         return self
 
@@ -137,23 +142,219 @@ class Dependencies(base.Config):
 
 class Files(base.Config):
     """Interface to package's `files.json` config file.
+
+    Besides explicit paths the list may contain glob patterns:
+
+        {"include": "src/**/*.py"}
+        {"exclude": "**/__pycache__/"}
+
+    Patterns are gitignore-style globs (see `pake.nest.scanner`) relative to the directory
+    containing the nest and are expanded when a package is built, so
+    files that appear in included directories need not be added one by one.
+
+    Absolute paths of listed files are kept in a set so checking for duplicates
+    does not require normalizing every entry of the list.
     """
     name = 'files.json'
     default = []
-    content = []
+
+    def __iter__(self):
+        return (i for i in self.content if type(i) is str)
+
+    def _loaded(self):
+        self._index = None
+
+    def _getindex(self):
+        """Returns set of absolute paths of listed files.
+        """
+        if self._index is None:
+            self._index = set(os.path.abspath(i) for i in self)
+        return self._index
+
+    def has(self, path):
+        """Returns True if file is already on the list (even if it was added using
+        different path to it).
+        """
+        return os.path.abspath(path) in self._getindex()
 
     def add(self, path):
         """Adds file to the list.
         """
         if not os.path.isfile(path): raise errors.NotAFileError(path)
-        for i in self:
-            if os.path.abspath(path) == os.path.abspath(i):
-                raise FileExistsError('file already added: {0}'.format(path))
+        if self.has(path): raise FileExistsError('file already added: {0}'.format(path))
+        self._modify()
         self.content.append(path)
+        self._getindex().add(os.path.abspath(path))
+        return self
+
+    def extend(self, paths):
+        """Adds many files to the list at once.
+        Files that are already on the list are skipped.
+        Nothing is added if any of the paths is not a file.
+        """
+        index = self._getindex()
+        new, added = [], set()
+        for path in paths:
+            if not os.path.isfile(path): raise errors.NotAFileError(path)
+            key = os.path.abspath(path)
+            if key in index or key in added: continue
+            added.add(key)
+            new.append(path)
+        if new:
+            self._modify()
+            self.content.extend(new)
+            index.update(added)
         return self
 
     def remove(self, path):
         """Removes file from the list.
         """
+        self._modify()
         self.content.remove(path)
+        # other entries may still point to the same file
+        self._index = None
+        return self
+
+    def _addpattern(self, kind, pattern):
+        entry = {kind: pattern}
+        if entry in self.content: raise FileExistsError('pattern already added: {0}: {1}'.format(kind, pattern))
+        self._modify()
+        self.content.append(entry)
+        return self
+
+    def include(self, pattern):
+        """Adds glob pattern of files to include.
+        """
+        return self._addpattern('include', pattern)
+
+    def exclude(self, pattern):
+        """Adds glob pattern of files (or directories) to exclude.
+        Exclusions apply only to files matched by include patterns, never to explicit paths.
+        """
+        return self._addpattern('exclude', pattern)
+
+    def patterns(self, kind=None):
+        """Returns list of two-tuples (kind, pattern) in order they were added.
+
+        :param kind: return only patterns of this kind ('include' or 'exclude')
+        """
+        found = []
+        for entry in self.content:
+            if type(entry) is not dict: continue
+            for k, pattern in entry.items():
+                if kind is None or k == kind: found.append((k, pattern))
+        return found
+
+    def removepattern(self, pattern):
+        """Removes pattern (include or exclude) from the list.
+        """
+        entries = [entry for entry in self.content if type(entry) is dict and pattern in entry.values()]
+        if not entries: raise KeyError('no such pattern: {0}'.format(pattern))
+        self._modify()
+        for entry in entries: self.content.remove(entry)
+        return self
+
+    def expand(self, base='.'):
+        """Returns sorted list of normalized paths of files in the package:
+        explicit paths and files matched by include patterns (but not by exclude patterns).
+
+        Included files are found with a single walk of the directory tree
+        starting from the longest literal prefixes of the include patterns.
+        Excluded directories are not entered and the nest itself is never included.
+
+        :param base: directory patterns are relative to
+        """
+        paths = set([os.path.normpath(i) for i in self])
+        include = [pattern for kind, pattern in self.patterns('include')]
+        if not include: return sorted(paths)
+        exclude = [pattern for kind, pattern in self.patterns('exclude')]
+        nest = os.path.relpath(os.path.abspath(self.root), os.path.abspath(base))
+        if not nest.startswith('..'): exclude.append('/{0}/'.format(nest.replace(os.sep, '/')))
+        prefixes = [scanner.getprefix(pattern) for pattern in include]
+        if None in prefixes: prefixes = ['']
+        # walk only the outermost directories, nested prefixes are covered by them
+        starts = []
+        for prefix in sorted(set(prefixes)):
+            if any([prefix == s or prefix.startswith(s + '/') or not s for s in starts]): continue
+            starts.append(prefix)
+        for start in starts:
+            directory = os.path.join(base, start)
+            if not os.path.isdir(directory): continue
+            for path in scanner.scan(directory, ignore=exclude, include=include, base=base):
+                paths.add(os.path.normpath(path))
+        return sorted(paths)
+
+
+class Manifest(base.Config):
+    """Interface to `manifest.json` file of a version (NESTROOT/versions/:version/manifest.json).
+
+    Manifest lists every member of the archive of the version with its
+    path, type, size, mode, SHA-256 digest (for regular files) and offset of
+    its data inside the uncompressed tar stream.
+    """
+    name = 'manifest.json'
+    default = {'archive': '', 'files': []}
+
+    def __iter__(self):
+        return iter(self.content['files'])
+
+    def set(self, archive, files):
+        """Sets archive name and list of its members.
+        """
+        self._modify()
+        self.content = {'archive': archive, 'files': files}
+        return self
+
+    def getarchive(self):
+        """Returns name of the archive described by manifest.
+        """
+        return self.content['archive']
+
+    def get(self, path):
+        """Returns entry of given path.
+        Raises KeyError if path is not in the archive.
+        """
+        path = os.path.normpath(path)
+        for entry in self:
+            if entry['path'] == path: return entry
+        raise KeyError(path)
+
+
+class BuildCache(base.Config):
+    """Interface to nest's `buildcache.json` file.
+
+    It keeps stat info and SHA-256 digests of files put in the last build
+    (so unchanged files are not hashed again), and describes the last built archive.
+    See `pake.nest.incremental`.
+    """
+    name = 'buildcache.json'
+    default = {'files': {}, 'archive': {}}
+    fsync = False
+
+    def getfile(self, path, stat):
+        """Returns digest of a file if its stat info did not change since it was recorded.
+        Otherwise, returns None.
+        """
+        entry = self.content['files'].get(path)
+        return (entry['sha256'] if entry is not None and entry['stat'] == stat else None)
+
+    def setfiles(self, files):
+        """Replaces recorded files.
+
+        :param files: dictionary mapping paths to {'stat': ..., 'sha256': ...} dicts
+        """
+        self._modify('files')
+        self.content['files'] = files
+        return self
+
+    def getarchive(self):
+        """Returns description of the last built archive.
+        """
+        return self.content['archive']
+
+    def setarchive(self, key, path, sha256):
+        """Records the last built archive.
+        """
+        self._modify('archive')
+        self.content['archive'] = {'key': key, 'path': path, 'sha256': sha256}
         return self
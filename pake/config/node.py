@@ -6,9 +6,22 @@
 
 
 from . import base
+from .. import records
 
 
-class Meta(base.Meta):
+class _Storage():
+    """Selects storage of node config.
+    If the node uses SQLite database objects from `pake.config.sqlite` module
+    are returned instead of JSON-backed ones.
+    """
+    def __new__(cls, root):
+        if cls.__module__ == __name__:
+            from . import sqlite
+            if sqlite.enabled(root): cls = getattr(sqlite, cls.__name__)
+        return object.__new__(cls)
+
+
+class Meta(_Storage, base.Meta):
     """Object representing node metadata.
 
     It is invalid unless it contains following fields:
@@ -23,12 +36,14 @@ class Meta(base.Meta):
     pass
 
 
-class Pushers(base.Config):
+class Pushers(_Storage, base.Config):
     """Interface to pushers.json file.
+
+    On disk pushers are stored as a list but the object keeps
+    URL -> index map so lookups by URL do not scan the list.
     """
     name = 'pushers.json'
     default = []
-    content = []
 
     def __iter__(self):
         return iter(self.content)
@@ -36,46 +51,47 @@ class Pushers(base.Config):
     def __list__(self):
         return self.content
 
+    def _loaded(self):
+        self._index = None
+
     def _getindex(self, url):
         """Returns index of a pusher.
         -1 means that pusher was not found.
 
         :param url: it is unique URL of a mirror, NOT A push-url
         """
-        index = -1
-        for i, pusher in enumerate(self.content):
-            if pusher['url'] == url:
-                index = i
-                break
-        return index
+        content = self.content
+        if self._index is None:
+            self._index = {}
+            for i, pusher in enumerate(content): self._index.setdefault(pusher['url'], i)
+        return self._index.get(url, -1)
 
     def hasurl(self, url):
         """Returns True if pushers.json already has pusher with given url.
         """
-        result = False
-        for p in self:
-            if p['url'] == url:
-                result = True
-                break
-        return result
+        return self._getindex(url) > -1
 
     def set(self, url, host, cwd=''):
         """Adds pusher to push.json list. Part of PAKE fluent API.
+        If pusher with given URL already exists its host and cwd are overwritten.
         """
         pusher = {'url': url, 'host': host, 'cwd': cwd}
-        if pusher not in self.content: self.content.append(pusher)
+        index = self._getindex(url)
+        if index == -1:
+            self._modify()
+            self.content.append(pusher)
+            self._index[url] = len(self.content) - 1
+        elif self.content[index] != pusher:
+            self._modify()
+            self.content[index] = pusher
         return self
 
     def get(self, url):
         """Returns pusher for given URL.
         Returns None if not found.
         """
-        pusher = None
-        for p in self:
-            if p['url'] == url:
-                pusher = p
-                break
-        return pusher
+        index = self._getindex(url)
+        return (self.content[index] if index > -1 else None)
 
     def remove(self, url):
         """Removes URL from list of pushers. Part of PAKE fluent API.
@@ -84,9 +100,19 @@ class Pushers(base.Config):
         :returns: index of removed mirror, -1 means that no pusher was removed
         """
         index = self._getindex(url)
-        if index > -1: del self.content[index]
+        if index > -1:
+            self._modify()
+            del self.content[index]
+            # indexes of the following pushers are shifted and older files may have more pushers
+            # with the same URL, so the map is rebuilt on next lookup
+            self._index = None
         return self
 
+    def iterpushers(self):
+        """Returns iterator over pushers as `pake.records.Pusher` objects.
+        """
+        return (records.Pusher(**pusher) for pusher in self.content)
+
     def geturls(self):
         """Returns list of URLs of all pushers which
         is, basically, a list of mirrors.
@@ -94,7 +120,7 @@ class Pushers(base.Config):
         return [pusher['url'] for pusher in self.content]
 
 
-class Aliens(base.Config):
+class Aliens(_Storage, base.Config):
     """Interface to aliens.json file.
 
     Alien dictionary:
@@ -105,38 +131,81 @@ class Aliens(base.Config):
     """
     name = 'aliens.json'
     default = {}
-    content = {}
 
     def __list__(self):
         return self.all()
 
     def __contains__(self, url):
         """Checks if nodes.json file contain node of given URL.
+        URL may be URL of any mirror of the alien.
         """
-        result = False
-        for i in self.content:
-            if i == url:
-                result = True
-            else:
-                for mirror in self.content[i]:
-                    if mirror == url:
-                        result = True
-                        break
-            if result: break
-        return result
+        return self.resolve(url) is not None
+
+    def _loaded(self):
+        self._mirrors = None
+
+    def _getmirrors(self):
+        """Returns mirror URL -> alien URL map.
+        The map is built on first use and is kept in sync by set() and remove()
+        (they rebuild it when they change mirrors listed by more than one alien).
+        """
+        content = self.content
+        if self._mirrors is None:
+            # number of aliens listing every mirror
+            self._mirrors, self._listed = {}, {}
+            for url in content:
+                for mirror in content[url]['mirrors']:
+                    self._mirrors.setdefault(mirror, url)
+                    self._listed[mirror] = self._listed.get(mirror, 0) + 1
+            for url in content: self._mirrors[url] = url
+        return self._mirrors
+
+    def _unmap(self, url):
+        """Removes mirrors of given alien from mirror map.
+        Returns False if nothing was removed because the map must be rebuilt instead (some of
+        the mirrors, or the alien itself, are listed by other aliens).
+        """
+        mirrors = self._getmirrors()
+        listed = (self.content[url]['mirrors'] if url in self.content else [])
+        if self._listed.get(url, 0) > listed.count(url): return False
+        if [m for m in listed if self._listed[m] > 1 or (m != url and m in self.content)]: return False
+        for mirror in listed:
+            del self._listed[mirror]
+            mirrors.pop(mirror, None)
+        mirrors.pop(url, None)
+        return True
+
+    def resolve(self, url):
+        """Returns URL of the alien (canonical URL) for URL of any of its mirrors.
+        Returns None if no alien with such mirror is registered.
+        """
+        return self._getmirrors().get(url)
 
     def set(self, url, mirrors, meta):
         """Sets node in your list of nodes.
         If a node with given URL already exists it's data is overwritten.
         Part of PAKE fluent API.
         """
+        unmapped = self._unmap(url)
+        self._modify(url)
         self.content[url] = {'mirrors': mirrors, 'meta': meta}
+        if unmapped and url not in self._mirrors and len(set(mirrors)) == len(mirrors) and \
+                not [mirror for mirror in mirrors if mirror in self._mirrors]:
+            for mirror in mirrors:
+                self._mirrors[mirror] = url
+                self._listed[mirror] = 1
+            self._mirrors[url] = url
+        else:
+            self._mirrors = None
         return self
 
     def remove(self, url):
         """Removes alien from the dictionary. Part of PAKE fluent API.
         """
+        unmapped = self._unmap(url)
+        self._modify(url)
         del self.content[url]
+        if not unmapped: self._mirrors = None
         return self
 
     def get(self, url):
@@ -149,6 +218,12 @@ class Aliens(base.Config):
         """
         return list(self.content.keys())
 
+    def iteraliens(self):
+        """Returns iterator over aliens as `pake.records.Alien` objects.
+        Mirror lists and metadata are not copied.
+        """
+        return (records.Alien(url, alien['mirrors'], alien['meta']) for url, alien in self.content.items())
+
     def all(self):
         """Return list of all alien nodes.
         """
@@ -163,14 +238,13 @@ class Aliens(base.Config):
         return aliens
 
 
-class Nests(base.Config):
+class Nests(_Storage, base.Config):
     """This is a list of registered nests.
     A nest is a directory on your local machine containing
     files for a package.
     """
     name = 'nests.json'
     default = {}
-    content = {}
 
     def set(self, name, path):
         """Registers a nest.
@@ -178,6 +252,7 @@ class Nests(base.Config):
         :param name: name of a package
         :param path: path to the nest
         """
+        self._modify(name)
         self.content[name] = path
         return self
 
@@ -186,6 +261,7 @@ class Nests(base.Config):
 
         :param name: name of a package whose nest to remove
         """
+        self._modify(name)
         del self.content[name]
         return self
 
@@ -205,3 +281,8 @@ class Nests(base.Config):
         """Returns names of registered nests.
         """
         return [k for k in self]
+
+    def iternests(self):
+        """Returns iterator over registered nests as `pake.records.NestRef` objects.
+        """
+        return (records.NestRef(name, self.get(name)) for name in self)
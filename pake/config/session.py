@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+
+"""Sessions batch modifications of several config files of one node or nest.
+
+Config files are opened lazily (on first access) and only once per session.
+Any number of changes can be applied to them in memory and
+every modified file is written exactly once when the session is flushed.
+
+Example:
+
+    with pake.config.session.NodeSession(root) as session:
+        for name, path in nests:
+            session.nests.set(name, path)
+"""
+
+
+from . import node
+from . import nest
+
+
+class Session():
+    """Base class for config sessions.
+    Subclasses must define `configs` dictionary mapping attribute names to
+    config classes.
+
+    When used as context manager the session is flushed on exit unless
+    an exception was raised - in such case all changes are discarded.
+
+    Sessions created with `lock=True` hold exclusive locks of all config files they
+    opened until they are closed, so other processes cannot modify them in the meantime.
+    """
+    configs = {}
+
+    def __init__(self, root, lock=False):
+        """
+        :param root: directory holding config files (.pakenode or .pakenest)
+        :param lock: hold exclusive locks of opened config files until the session is closed
+        """
+        self.root = root
+        self._lock = lock
+        self._opened = {}
+        self._locks = []
+
+    def __getattr__(self, name):
+        if name not in self.configs: raise AttributeError(name)
+        if name not in self._opened:
+            config = self.configs[name](self.root)
+            if self._lock:
+                # configs are read lazily so they will be read under the lock
+                lock = config.locked()
+                lock.__enter__()
+                self._locks.append(lock)
+            self._opened[name] = config
+        return self._opened[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        try:
+            if kind is None: self.flush()
+            else: self.discard()
+        finally:
+            self.close()
+        return False
+
+    def close(self):
+        """Releases locks held by the session.
+        """
+        while self._locks: self._locks.pop().__exit__(None, None, None)
+        return self
+
+    def opened(self):
+        """Returns names of config files opened in this session.
+        """
+        return list(self._opened.keys())
+
+    def flush(self):
+        """Writes every modified config file.
+        Unmodified config files are not written.
+        """
+        for name in self._opened: self._opened[name].write()
+        return self
+
+    def discard(self):
+        """Discards all changes that were not flushed.
+        """
+        self._opened = {}
+        return self
+
+
+class NodeSession(Session):
+    """Session for node config files.
+    """
+    configs = {'meta': node.Meta,
+               'pushers': node.Pushers,
+               'aliens': node.Aliens,
+               'nests': node.Nests,
+               }
+
+
+class NestSession(Session):
+    """Session for nest config files.
+    """
+    configs = {'meta': nest.Meta,
+               'versions': nest.Versions,
+               'dependencies': nest.Dependencies,
+               'files': nest.Files,
+               }
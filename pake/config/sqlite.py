@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+
+
+"""SQLite-backed storage for node configuration.
+
+Nodes with large networks may keep their configuration in a single
+SQLite database (`.pakenode/db/node.sqlite`) instead of JSON files.
+Lookups go through indexes and `write()` stores only what has changed.
+
+Objects in this module provide the same fluent API as their JSON
+counterparts in `pake.config.node` and are returned automatically by
+`pake.config.node.Meta(root)`, `Pushers(root)`, `Aliens(root)` and `Nests(root)`
+when the database exists in given root.
+JSON files are still used for data sent to the network so they must be
+regenerated with `export()` before pushing.
+
+Use `migrate()` to create the database from existing JSON files.
+"""
+
+
+import abc
+import contextlib
+import json
+import os
+import sqlite3
+
+from . import base
+from . import node
+from .. import records
+
+
+DBNAME = os.path.join('db', 'node.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS nests (name TEXT PRIMARY KEY, path TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pushers (url TEXT PRIMARY KEY, host TEXT NOT NULL, cwd TEXT NOT NULL,
+                                    position INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS pushers_position ON pushers (position);
+CREATE TABLE IF NOT EXISTS aliens (url TEXT PRIMARY KEY, mirrors TEXT NOT NULL, meta TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS mirrors (mirror TEXT NOT NULL, alien TEXT NOT NULL, PRIMARY KEY (mirror, alien));
+CREATE INDEX IF NOT EXISTS mirrors_alien ON mirrors (alien);
+"""
+
+
+# marks keys removed from pending changes
+_DELETED = object()
+
+
+def getpath(root):
+    """Returns path to the database of node in given root.
+    """
+    return os.path.join(root, DBNAME)
+
+
+def enabled(root):
+    """Returns True if node in given root uses SQLite storage.
+    """
+    return os.path.isfile(getpath(root))
+
+
+def connect(root):
+    """Returns connection to the database of node in given root.
+    Schema is created if it's not present.
+    """
+    db = sqlite3.connect(getpath(root), timeout=30)
+    db.executescript(SCHEMA)
+    return db
+
+
+def migrate(root):
+    """Creates database from JSON config files of the node.
+    JSON files are not removed.
+
+    :param root: node root directory (with .pakenode part)
+    """
+    if enabled(root): raise FileExistsError(getpath(root))
+    configs = [node.Meta(root), node.Nests(root), node.Pushers(root), node.Aliens(root)]
+    try:
+        for config in configs:
+            store = globals()[type(config).__name__](root)
+            store.reset()
+            if isinstance(config, node.Pushers):
+                for pusher in config: store.set(**pusher)
+            elif isinstance(config, node.Aliens):
+                for url in config: store.set(url=url, **config.get(url))
+            else:
+                for key in config: store.set(key, config[key])
+            store.write()
+    except BaseException:
+        # database may not have been created yet
+        with contextlib.suppress(FileNotFoundError): os.remove(getpath(root))
+        raise
+
+
+def export(root, pretty=False):
+    """Writes JSON config files from the database.
+
+    :param root: node root directory (with .pakenode part)
+    :param pretty: enable pretty formatting of JSON
+    """
+    for kind in [Meta, Nests, Pushers, Aliens]: kind(root).export(root, pretty=pretty)
+
+
+def backup(root):
+    """Returns contents of the database file or None if node does not use SQLite storage.
+    """
+    data = None
+    if enabled(root):
+        ifstream = open(getpath(root), 'rb')
+        data = ifstream.read()
+        ifstream.close()
+    return data
+
+
+def restore(root, data):
+    """Restores database file from data returned by backup().
+    """
+    if data is None: return
+    ofstream = open(getpath(root), 'wb')
+    ofstream.write(data)
+    ofstream.close()
+
+
+class _Store(abc.ABC):
+    """Base for config objects stored in SQLite database.
+
+    Changes are kept in memory (on top of the database) until
+    `write()` is called which stores all of them in one transaction.
+    """
+    table = ''
+    key = ''
+
+    def __init__(self, root):
+        self.root = root
+        self._db = None
+        self.read()
+
+    def __del__(self):
+        if getattr(self, '_db', None) is not None: self._db.close()
+
+    def __contains__(self, key):
+        try:
+            self._lookup(key)
+            result = True
+        except KeyError:
+            result = False
+        return result
+
+    def __getitem__(self, item):
+        return self._lookup(item)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __list__(self):
+        return self._keys()
+
+    def _getdb(self):
+        if self._db is None: self._db = connect(self.root)
+        return self._db
+
+    @abc.abstractmethod
+    def _select(self, key):
+        """Returns value for key stored in database.
+        Raises KeyError if it's not found.
+        """
+
+    @abc.abstractmethod
+    def _insert(self, db, key, value):
+        """Stores value in database.
+        """
+
+    def _delete(self, db, key):
+        """Removes value from database.
+        """
+        db.execute('DELETE FROM {0} WHERE {1} = ?'.format(self.table, self.key), (key,))
+
+    def _clear(self, db):
+        """Removes all values from database.
+        """
+        db.execute('DELETE FROM {0}'.format(self.table))
+
+    @abc.abstractmethod
+    def _selectall(self):
+        """Returns list of (key, value) two-tuples stored in database.
+        """
+
+    def _stored(self):
+        """Returns list of keys stored in database.
+        """
+        if self._cleared: return []
+        query = 'SELECT {0} FROM {1} ORDER BY rowid'.format(self.key, self.table)
+        return [row[0] for row in self._getdb().execute(query)]
+
+    def _items(self):
+        """Returns list of (key, value) two-tuples with changes kept in memory applied.
+        """
+        stored = ([] if self._cleared else self._selectall())
+        items = [(k, self._pending.get(k, v)) for k, v in stored if self._pending.get(k) is not _DELETED]
+        known = set([k for k, v in stored])
+        items.extend([(k, v) for k, v in self._pending.items() if v is not _DELETED and k not in known])
+        return items
+
+    def _keys(self):
+        keys = [k for k in self._stored() if self._pending.get(k) is not _DELETED]
+        stored = set(keys)
+        keys.extend([k for k in self._pending if self._pending[k] is not _DELETED and k not in stored])
+        return keys
+
+    def _lookup(self, key):
+        if key in self._pending:
+            value = self._pending[key]
+            if value is _DELETED: raise KeyError(key)
+        elif self._cleared:
+            raise KeyError(key)
+        else:
+            value = self._select(key)
+        return value
+
+    def _put(self, key, value):
+        self._pending[key] = value
+        return self
+
+    def _remove(self, key):
+        self._lookup(key)
+        self._pending[key] = _DELETED
+        return self
+
+    @property
+    def content(self):
+        """Snapshot of the config in the same form as is used by JSON files.
+        """
+        return dict(self._items())
+
+    def modified(self):
+        """Returns True if there are changes not stored in database.
+        """
+        return bool(self._pending) or self._cleared
+
+    def read(self):
+        """Drops changes not stored in database.
+        """
+        self._pending = {}
+        self._cleared = False
+        return self
+
+    def reset(self):
+        """Resets config to it's default (empty) value.
+        """
+        self._pending = {}
+        self._cleared = True
+        return self
+
+    def export(self, root='', pretty=False, fsync=None):
+        """Writes config as JSON file.
+        """
+        if fsync is None: fsync = self.fsync
+        path = os.path.join(root or self.root, self.name)
+        base._writeatomic(path, base.encode(self.content, pretty), fsync=fsync)
+        base.invalidate(path)
+        return self
+
+    def write(self, root='', pretty=False, fsync=None, force=False):
+        """Stores changes in database.
+        If root is given or pretty formatting is requested config is
+        also exported as JSON file.
+
+        :param fsync: override `fsync` class attribute for this write (database is synced
+                      with `PRAGMA synchronous = FULL`, or NORMAL if fsync is False)
+        """
+        if fsync is None: fsync = self.fsync
+        if self.modified():
+            db = self._getdb()
+            db.execute('PRAGMA synchronous = {0}'.format('FULL' if fsync else 'NORMAL'))
+            with db:
+                if self._cleared: self._clear(db)
+                for key, value in self._pending.items():
+                    if value is _DELETED: self._delete(db, key)
+                    else: self._insert(db, key, value)
+            self.read()
+        if root or pretty: self.export(root, pretty=pretty, fsync=fsync)
+        return self
+
+
+class Meta(_Store, node.Meta):
+    """Node metadata stored in SQLite database.
+    """
+    table = 'meta'
+    key = 'key'
+
+    def _select(self, key):
+        row = self._getdb().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        if row is None: raise KeyError(key)
+        return json.loads(row[0])
+
+    def _selectall(self):
+        return [(k, json.loads(v)) for k, v in self._getdb().execute('SELECT key, value FROM meta ORDER BY rowid')]
+
+    def _insert(self, db, key, value):
+        db.execute('INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                   (key, json.dumps(value)))
+
+    def set(self, key, value):
+        return self._put(key, value)
+
+    def remove(self, key):
+        return self._remove(key)
+
+    def get(self, key):
+        return self._lookup(key)
+
+    def keys(self):
+        return self._keys()
+
+
+class Nests(_Store, node.Nests):
+    """Registered nests stored in SQLite database.
+    """
+    table = 'nests'
+    key = 'name'
+
+    def _select(self, name):
+        row = self._getdb().execute('SELECT path FROM nests WHERE name = ?', (name,)).fetchone()
+        if row is None: raise KeyError(name)
+        return row[0]
+
+    def _selectall(self):
+        return self._getdb().execute('SELECT name, path FROM nests ORDER BY rowid').fetchall()
+
+    def _insert(self, db, name, path):
+        db.execute('INSERT INTO nests (name, path) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET path = excluded.path',
+                   (name, path))
+
+    def set(self, name, path):
+        return self._put(name, path)
+
+    def remove(self, name):
+        return self._remove(name)
+
+    def get(self, name):
+        return self._lookup(name)
+
+
+class Pushers(_Store, node.Pushers):
+    """Pushers stored in SQLite database.
+    Iterating over pushers yields pusher dictionaries (as with pushers.json).
+    """
+    table = 'pushers'
+    key = 'url'
+
+    def __contains__(self, pusher):
+        return pusher in self.content
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def __list__(self):
+        return self.content
+
+    def _select(self, url):
+        row = self._getdb().execute('SELECT url, host, cwd FROM pushers WHERE url = ?', (url,)).fetchone()
+        if row is None: raise KeyError(url)
+        return {'url': row[0], 'host': row[1], 'cwd': row[2]}
+
+    def _selectall(self):
+        rows = self._getdb().execute('SELECT url, host, cwd FROM pushers ORDER BY position')
+        return [(url, {'url': url, 'host': host, 'cwd': cwd}) for url, host, cwd in rows]
+
+    def _stored(self):
+        if self._cleared: return []
+        return [row[0] for row in self._getdb().execute('SELECT url FROM pushers ORDER BY position')]
+
+    def _insert(self, db, url, pusher):
+        position = db.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM pushers').fetchone()[0]
+        db.execute('INSERT INTO pushers (url, host, cwd, position) VALUES (?, ?, ?, ?) '
+                   'ON CONFLICT (url) DO UPDATE SET host = excluded.host, cwd = excluded.cwd',
+                   (url, pusher['host'], pusher['cwd'], position))
+
+    @property
+    def content(self):
+        return [pusher for url, pusher in self._items()]
+
+    def _getindex(self, url):
+        return (self._keys().index(url) if self.hasurl(url) else -1)
+
+    def hasurl(self, url):
+        return _Store.__contains__(self, url)
+
+    def set(self, url, host, cwd=''):
+        return self._put(url, {'url': url, 'host': host, 'cwd': cwd})
+
+    def get(self, url):
+        return (self._lookup(url) if self.hasurl(url) else None)
+
+    def remove(self, url):
+        if self.hasurl(url): self._remove(url)
+        return self
+
+    def geturls(self):
+        return self._keys()
+
+
+class Aliens(_Store, node.Aliens):
+    """Aliens stored in SQLite database.
+    Mirrors of aliens are indexed so resolve() and membership tests
+    do not need to load all aliens.
+    """
+    table = 'aliens'
+    key = 'url'
+
+    def __contains__(self, url):
+        return self.resolve(url) is not None
+
+    def _select(self, url):
+        row = self._getdb().execute('SELECT mirrors, meta FROM aliens WHERE url = ?', (url,)).fetchone()
+        if row is None: raise KeyError(url)
+        return {'mirrors': json.loads(row[0]), 'meta': json.loads(row[1])}
+
+    def _selectall(self):
+        rows = self._getdb().execute('SELECT url, mirrors, meta FROM aliens ORDER BY rowid')
+        return [(url, {'mirrors': json.loads(mirrors), 'meta': json.loads(meta)}) for url, mirrors, meta in rows]
+
+    def _insert(self, db, url, alien):
+        db.execute('INSERT INTO aliens (url, mirrors, meta) VALUES (?, ?, ?) '
+                   'ON CONFLICT (url) DO UPDATE SET mirrors = excluded.mirrors, meta = excluded.meta',
+                   (url, json.dumps(alien['mirrors']), json.dumps(alien['meta'])))
+        db.execute('DELETE FROM mirrors WHERE alien = ?', (url,))
+        db.executemany('INSERT OR IGNORE INTO mirrors (mirror, alien) VALUES (?, ?)',
+                       [(m, url) for m in alien['mirrors']])
+
+    def _delete(self, db, url):
+        db.execute('DELETE FROM aliens WHERE url = ?', (url,))
+        db.execute('DELETE FROM mirrors WHERE alien = ?', (url,))
+
+    def _clear(self, db):
+        db.execute('DELETE FROM aliens')
+        db.execute('DELETE FROM mirrors')
+
+    def iteraliens(self):
+        """Returns iterator over aliens as `pake.records.Alien` objects.
+        Mirror lists and metadata of aliens not changed in memory are decoded
+        only when they are accessed.
+        """
+        if not self._cleared:
+            rows = self._getdb().execute('SELECT url, mirrors, meta FROM aliens ORDER BY rowid')
+            for url, mirrors, meta in rows:
+                if url not in self._pending: yield records.Alien(url, records.Encoded(mirrors), records.Encoded(meta))
+        for url, alien in self._pending.items():
+            if alien is not _DELETED: yield records.Alien(url, alien['mirrors'], alien['meta'])
+
+    def resolve(self, url):
+        if _Store.__contains__(self, url): return url
+        for alien, value in self._pending.items():
+            if value is not _DELETED and url in value['mirrors']: return alien
+        if self._cleared: return None
+        rows = self._getdb().execute('SELECT alien FROM mirrors WHERE mirror = ? ORDER BY rowid', (url,))
+        for row in rows:
+            # aliens changed in memory are already checked
+            if row[0] not in self._pending: return row[0]
+        return None
+
+    def set(self, url, mirrors, meta):
+        return self._put(url, {'mirrors': mirrors, 'meta': meta})
+
+    def remove(self, url):
+        return self._remove(url)
+
+    def get(self, url):
+        return self._lookup(url)
+
+    def urls(self):
+        return self._keys()
@@ -10,6 +10,12 @@ class NodeError(PAKEError):
     pass
 
 
+class PushError(NodeError):
+    """Raised when some files could not be pushed to a mirror.
+    """
+    pass
+
+
 class DuplicateError(PAKEError):
     """PAKEError raised when trying to add a node duplicate.
     """
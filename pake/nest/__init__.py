@@ -4,3 +4,7 @@
 
 from . import manager
 from . import package
+from . import compress
+from . import incremental
+from . import delta
+from . import scanner
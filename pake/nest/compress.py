@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+"""Compression of package archives.
+
+Archives can be compressed with one of registered codecs:
+
+    * xz:       levels 0-9 (and 0e-9e for extreme presets), default 6,
+    * gzip:     levels 1-9, default 6,
+    * bz2:      levels 1-9, default 9,
+    * zstd:     levels 1-22, default 3 (only if `zstandard` module is installed),
+
+Codec used to build a version is recorded in its `meta.json` under the `build` key,
+so fetchers know the name of the archive.
+
+xz compression is done in parallel.
+Data written to the compressor is split into blocks which are compressed
+independently on a pool of threads (the lzma module releases the GIL while
+compressing) and written to the output file in order.
+Every block becomes a separate xz stream.
+Concatenated xz streams are a valid .xz file, so archives can be extracted by
+`xz`, `tar -xJf` and Python's `tarfile`/`lzma` modules.
+Block boundaries do not depend on the number of threads so
+the same data always produces the same archive.
+
+Example:
+
+    with pake.nest.compress.openarchive('build.tar.xz', codec='xz', level='9e', threads=4) as ofstream:
+        with tarfile.open(fileobj=ofstream, mode='w|') as package:
+            package.add('foo.py')
+"""
+
+
+import abc
+import collections
+import concurrent.futures
+import bz2
+import gzip
+import lzma
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .. import errors
+
+
+# dictionary sizes used by xz presets 0-9
+DICTSIZES = [256, 1024, 2048, 4096, 4096, 8192, 8192, 16384, 32768, 65536]
+
+
+def getthreads(threads=None):
+    """Returns number of threads to use for compression.
+
+    :param threads: requested number of threads, None or 0 means "one per CPU"
+    """
+    if not threads: threads = (os.cpu_count() or 1)
+    return max(1, threads)
+
+
+def getblocksize(preset=6):
+    """Returns default size of a block for given preset.
+    Like `xz -T` it is three times the dictionary size, so splitting data into blocks
+    costs little compression ratio.
+    """
+    return 3 * DICTSIZES[preset & ~lzma.PRESET_EXTREME] * 1024
+
+
+class XZWriter():
+    """Writable file-like object compressing data to xz format.
+
+    Data is compressed in blocks on a thread pool (with one thread, blocks are
+    compressed in the calling thread).
+    At most `2 * threads` blocks are held in memory at a time.
+    """
+    def __init__(self, fileobj, threads=None, preset=6, blocksize=None):
+        """
+        :param fileobj: binary file object to write compressed data to
+        :param threads: number of compressing threads (default: one per CPU)
+        :param preset: xz preset (0-9, may be OR-ed with lzma.PRESET_EXTREME)
+        :param blocksize: size of uncompressed block (default: three times the dictionary size)
+        """
+        self.fileobj = fileobj
+        self.threads = getthreads(threads)
+        self.preset = preset
+        self.blocksize = (blocksize or getblocksize(preset))
+        self.closed = False
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._pool = None
+        if self.threads > 1: self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None: self.close()
+        else: self.abort()
+        return False
+
+    def _submit(self, block):
+        if self._pool is None:
+            self.fileobj.write(lzma.compress(block, format=lzma.FORMAT_XZ, preset=self.preset))
+            return
+        self._pending.append(self._pool.submit(lzma.compress, block, format=lzma.FORMAT_XZ, preset=self.preset))
+        while len(self._pending) >= 2 * self.threads: self._drain(1)
+
+    def _drain(self, n=None):
+        """Writes compressed blocks in order.
+        """
+        while self._pending and (n is None or n > 0):
+            self.fileobj.write(self._pending.popleft().result())
+            if n is not None: n -= 1
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """Compresses data.
+
+        :returns: number of bytes written
+        """
+        if self.closed: raise ValueError('write to closed file')
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.blocksize:
+            self._submit(bytes(self._buffer[:self.blocksize]))
+            del self._buffer[:self.blocksize]
+        return len(data)
+
+    def flush(self):
+        """Does nothing; blocks are written out as soon as they are compressed.
+        """
+        pass
+
+    def close(self):
+        """Compresses remaining data and writes it to the file.
+        File object is not closed.
+        """
+        if self.closed: return
+        self.closed = True
+        # an empty archive must still be a valid xz file
+        if self._buffer or not self._pending: self._submit(bytes(self._buffer))
+        self._buffer = bytearray()
+        try:
+            self._drain()
+        finally:
+            if self._pool is not None: self._pool.shutdown()
+
+    def abort(self):
+        """Discards data that was not written yet.
+        """
+        self.closed = True
+        if self._pool is not None:
+            for future in self._pending: future.cancel()
+            self._pending.clear()
+            self._pool.shutdown()
+
+
+class Codec(abc.ABC):
+    """Base class of archive codecs.
+    """
+    name = ''
+    extension = ''
+    levels = range(0)
+    default = None
+
+    def available(self):
+        """Returns True if the codec can be used.
+        """
+        return True
+
+    def getarchive(self):
+        """Returns name of the archive file.
+        """
+        return 'build.tar.{0}'.format(self.extension)
+
+    def parselevel(self, level=None):
+        """Returns compression level as accepted by the compressor.
+        Level may be given as integer or as string (as typed by users).
+        """
+        if level is None or level == '': return self.default
+        try:
+            level = int(level)
+        except ValueError:
+            raise errors.PackageError('invalid {0} compression level: {1}'.format(self.name, level))
+        if level not in self.levels:
+            raise errors.PackageError('invalid {0} compression level: {1}'.format(self.name, level))
+        return level
+
+    def getblocksize(self, level):
+        """Returns size of blocks in which data is compressed independently.
+        """
+        return 4 * 1024 * 1024
+
+    @abc.abstractmethod
+    def compress(self, data, level):
+        """Compresses data as one self-contained stream.
+        Concatenated streams must form a valid archive.
+
+        :param level: compression level as returned by parselevel()
+        """
+
+    @abc.abstractmethod
+    def writer(self, fileobj, level=None, threads=None):
+        """Returns writable file object compressing data to fileobj.
+        Closing the writer must not close fileobj.
+        """
+
+    @abc.abstractmethod
+    def reader(self, fileobj):
+        """Returns readable file object decompressing data from fileobj.
+        """
+
+
+class XZCodec(Codec):
+    name = 'xz'
+    extension = 'xz'
+    levels = range(10)
+    default = 6
+
+    def parselevel(self, level=None):
+        if type(level) is str and level.endswith('e'): return Codec.parselevel(self, level[:-1]) | lzma.PRESET_EXTREME
+        return Codec.parselevel(self, level)
+
+    def getblocksize(self, level):
+        return getblocksize(level)
+
+    def compress(self, data, level):
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+    def writer(self, fileobj, level=None, threads=None):
+        return XZWriter(fileobj, threads=threads, preset=self.parselevel(level))
+
+    def reader(self, fileobj):
+        return lzma.LZMAFile(fileobj, 'rb')
+
+
+class GzipCodec(Codec):
+    name = 'gzip'
+    extension = 'gz'
+    levels = range(1, 10)
+    default = 6
+
+    def compress(self, data, level):
+        return gzip.compress(data, compresslevel=level, mtime=0)
+
+    def writer(self, fileobj, level=None, threads=None):
+        # name and mtime of the file are not stored so archives are reproducible
+        return gzip.GzipFile(filename='', fileobj=fileobj, mode='wb', compresslevel=self.parselevel(level), mtime=0)
+
+    def reader(self, fileobj):
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+
+
+class Bzip2Codec(Codec):
+    name = 'bz2'
+    extension = 'bz2'
+    levels = range(1, 10)
+    default = 9
+
+    def compress(self, data, level):
+        return bz2.compress(data, compresslevel=level)
+
+    def writer(self, fileobj, level=None, threads=None):
+        return bz2.BZ2File(fileobj, 'wb', compresslevel=self.parselevel(level))
+
+    def reader(self, fileobj):
+        return bz2.BZ2File(fileobj, 'rb')
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    extension = 'zst'
+    levels = range(1, 23)
+    default = 3
+
+    def available(self):
+        return zstandard is not None
+
+    def compress(self, data, level):
+        return zstandard.ZstdCompressor(level=level).compress(data)
+
+    def writer(self, fileobj, level=None, threads=None):
+        # zstandard uses -1 for "one per CPU"; 0 ("no worker threads") is never used
+        # since output of the single-threaded mode differs from the multi-threaded one
+        threads = (threads or -1)
+        compressor = zstandard.ZstdCompressor(level=self.parselevel(level), threads=threads)
+        return compressor.stream_writer(fileobj, closefd=False)
+
+    def reader(self, fileobj):
+        return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+
+
+codecs = {}
+
+
+def register(codec):
+    """Registers codec object under its name.
+    """
+    codecs[codec.name] = codec
+    return codec
+
+
+register(XZCodec())
+register(GzipCodec())
+register(Bzip2Codec())
+register(ZstdCodec())
+
+
+def getcodec(name):
+    """Returns codec registered under given name.
+    Raises PackageError if the codec is unknown or cannot be used.
+    """
+    if name not in codecs: raise errors.PackageError('unknown codec: {0}'.format(name))
+    if not codecs[name].available(): raise errors.PackageError('codec not available: {0}'.format(name))
+    return codecs[name]
+
+
+def available():
+    """Returns names of codecs that can be used.
+    """
+    return [name for name in codecs if codecs[name].available()]
+
+
+def getarchive(meta):
+    """Returns name of the archive of a version from its metadata.
+    Versions built before codecs were recorded use `build.tar.xz`.
+
+    :param meta: metadata of the version (dict or config.nest.Meta)
+    """
+    build = (meta.get('build') if 'build' in meta else None)
+    return (build['archive'] if build else 'build.tar.xz')
+
+
+class _Archive():
+    """Writer owning the file it writes to.
+    """
+    def __init__(self, writer, fileobj):
+        self.writer = writer
+        self.fileobj = fileobj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None: self.close()
+        else: self.abort()
+        return False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        return self.writer.write(data)
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        try:
+            self.writer.close()
+        finally:
+            self.fileobj.close()
+
+    def abort(self):
+        """Closes the file without finishing compression (if the codec allows it).
+        """
+        try:
+            if hasattr(self.writer, 'abort'): self.writer.abort()
+        finally:
+            self.fileobj.close()
+
+
+def openarchive(path, codec='xz', level=None, threads=None):
+    """Opens file for writing compressed data.
+    The file is closed when the returned writer is closed.
+
+    :param path: path of the file to write
+    :param codec: name of the codec
+    :param level: compression level (default depends on codec)
+    :param threads: number of compressing threads, for codecs that support them (default: one per CPU)
+    """
+    codec = getcodec(codec)
+    fileobj = open(path, 'wb')
+    try:
+        writer = codec.writer(fileobj, level=level, threads=threads)
+    except Exception:
+        fileobj.close()
+        raise
+    return _Archive(writer, fileobj)
+
+
+def xzopen(path, threads=None, preset=6, blocksize=None):
+    """Opens file for writing xz-compressed data.
+    The file is closed when the writer is closed.
+
+    :param path: path of the file to write
+    :param threads: number of compressing threads (default: one per CPU)
+    :param preset: xz preset
+    :param blocksize: size of uncompressed block
+    """
+    fileobj = open(path, 'wb')
+    return _Archive(XZWriter(fileobj, threads=threads, preset=preset, blocksize=blocksize), fileobj)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""Delta packages between versions.
+
+Delta archive of version B from version A contains files of B that were added or changed
+since A (according to manifests of both versions) and `.pakedelta.json` member with
+list of removed paths:
+
+    {"from": "A", "to": "B", "removed": ["path", ...]}
+
+Delta is described in meta.json of version B under `build.delta` key:
+
+    {"from": "A", "archive": "delta-from-A.tar.xz", "size": 1024, "sha256": "..."}
+
+so fetchers holding version A can download only the delta.
+"""
+
+
+import io
+import json
+import os
+import tarfile
+
+from . import compress
+from . import incremental
+from .. import config, shared
+
+
+MEMBER = '.pakedelta.json'
+
+
+def getarchive(previous, codec):
+    """Returns name of delta archive.
+
+    :param previous: version the delta is computed from
+    :param codec: codec object
+    """
+    return 'delta-from-{0}.tar.{1}'.format(previous, codec.extension)
+
+
+def _entrykey(entry):
+    return (entry['type'], entry.get('sha256'), entry['mode'], entry.get('target'))
+
+
+def diff(old, new):
+    """Compares two manifests.
+
+    :param old: list of manifest entries of the previous version
+    :param new: list of manifest entries of the new version
+    :returns: two-tuple (list-of-changed-or-added-entries, list-of-removed-paths)
+    """
+    old = dict([(entry['path'], _entrykey(entry)) for entry in old])
+    paths = set([entry['path'] for entry in new])
+    changed = [entry for entry in new if old.get(entry['path']) != _entrykey(entry)]
+    removed = sorted([path for path in old if path not in paths])
+    return (changed, removed)
+
+
+def _arcname(path):
+    """Returns name of member for given path (the way tarfile computes it).
+    """
+    return os.path.normpath(path).replace(os.sep, '/').lstrip('/')
+
+
+def writedelta(path, paths, removed, previous, version, codec='xz', level=None, threads=None, mtime=0):
+    """Writes delta archive.
+
+    :param path: path of the archive
+    :param paths: paths of files to include
+    :param removed: list of removed paths
+    :param previous: version the delta is computed from
+    :param version: version the delta leads to
+    :returns: SHA-256 digest of the archive
+    """
+    info = json.dumps({'from': previous, 'to': version, 'removed': removed}, sort_keys=True).encode('utf-8')
+    with compress.openarchive(path, codec=codec, level=level, threads=threads) as ofstream:
+        package = tarfile.open(fileobj=ofstream, mode='w|', format=tarfile.GNU_FORMAT)
+        tarinfo = incremental.normalize(tarfile.TarInfo(MEMBER), mtime)
+        tarinfo.size = len(info)
+        package.addfile(tarinfo, io.BytesIO(info))
+        for f in sorted(paths, key=_arcname):
+            package.add(f, recursive=False, filter=lambda tarinfo: incremental.normalize(tarinfo, mtime))
+        package.close()
+    return shared.filedigest(path)
+
+
+def build(root, previous, version, paths, manifest, codec='xz', level=None, threads=None, mtime=0):
+    """Builds delta of a version from the previous one.
+    Returns description of the delta (as stored in meta.json) or
+    None if the previous version has no manifest.
+
+    :param root: root of the nest
+    :param previous: previous version
+    :param version: version being built
+    :param paths: paths of files put in the archive of the version being built
+    :param manifest: manifest entries of the version being built
+    """
+    oldpath = os.path.join(root, 'versions', previous, config.nest.Manifest.name)
+    if not os.path.isfile(oldpath): return None
+    changed, removed = diff(list(config.nest.Manifest(os.path.dirname(oldpath))), manifest)
+    codec = compress.getcodec(codec)
+    archive = getarchive(previous, codec)
+    path = os.path.join(root, 'versions', version, archive)
+    names = dict([(_arcname(f), f) for f in paths])
+    sha256 = writedelta(path, [names[entry['path']] for entry in changed], removed, previous, version,
+                        codec=codec.name, level=level, threads=threads, mtime=mtime)
+    return {'from': previous,
+            'archive': archive,
+            'size': os.path.getsize(path),
+            'sha256': sha256,
+            }
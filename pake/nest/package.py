@@ -6,12 +6,14 @@ adding/removing files and directories.
 
 import os
 import shutil
-import tarfile
 import warnings
 
 import pyversion
-from but import scanner as butscanner
 
+from . import compress
+from . import incremental
+from . import delta as deltas
+from . import scanner
 from .. import config, errors
 
 
@@ -22,12 +24,10 @@ def addfile(root, path):
     :param path: path to add
     """
     if not os.path.isfile(path): raise errors.NotAFileError('\'{0}\' is not a file'.format(path))
-    files = config.nest.Files(root)
-    if os.path.normpath(path) not in [os.path.normpath(i) for i in files]: files.add(path)
-    files.write()
+    config.nest.Files(root).extend([path]).write()
 
 
-def adddir(root, path, recursive=True, avoid=[], avoid_exts=[]):
+def adddir(root, path, recursive=True, avoid=[], avoid_exts=[], ignore=[]):
     """Add path to list of files.
 
     :param root: root of nest
@@ -35,15 +35,42 @@ def adddir(root, path, recursive=True, avoid=[], avoid_exts=[]):
     :param recursive: scan subdirectories recursively (or not)
     :param avoid: list of regexp strings which, if the match is found, will cause file or directory not to be added
     :param avoid_exts: do not add files with these extensions
+    :param ignore: list of gitignore-style globs of files and directories not to add
     """
     if not os.path.isdir(path): raise OSError('\'{0}\' is not a directory'.format(path))
-    scanner = butscanner.Scanner(path)
-    for i in avoid_exts: scanner.discardExtension(i)
-    for i in avoid: scanner.discardRegexp(i)
-    for i in scanner.scan().files: addfile(root, i)
+    found = scanner.scan(path, recursive=recursive, avoid=avoid, extensions=avoid_exts, ignore=ignore)
+    config.nest.Files(root).extend(found).write()
+
+
+def getmtime():
+    """Returns modification time stored in archives.
+    It is taken from SOURCE_DATE_EPOCH environment variable (see https://reproducible-builds.org/)
+    and defaults to 0.
+    """
+    try:
+        return int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+    except ValueError:
+        warnings.warn('invalid SOURCE_DATE_EPOCH: {0}'.format(os.environ['SOURCE_DATE_EPOCH']))
+        return 0
+
+
+def getmembers(files):
+    """Returns sorted list of paths to put in the archive.
+    Directories are expanded.
+
+    :param files: paths listed in files.json
+    """
+    members = set()
+    for f in files:
+        f = os.path.normpath(f)
+        members.add(f)
+        if os.path.isdir(f):
+            for path, dirnames, filenames in os.walk(f):
+                members.update([os.path.join(path, i) for i in dirnames + filenames])
+    return sorted(members)
 
 
-def build(root, version):
+def build(root, version, codec='xz', level=None, threads=None, cache=True, delta=False):
     """Builds a package from files contained in nest.
     Version for the build is taken from meta.
     This forces user to regularly update the metadata and
@@ -52,10 +79,29 @@ def build(root, version):
     removal of the newly created directory, check, manual edit of versions.json and
     a rebuild.
 
-    Archive file is named: build.tar.xz
-    It is located in NESTROOT/versions/:version/build.tar.xz
+    Archive file is named: build.tar.{ext}, where extension depends on codec
+    (build.tar.xz by default).
+    It is located in NESTROOT/versions/:version/build.tar.{ext}
+    Codec, archive name, its size and sha256 are recorded in NESTROOT/versions/:version/meta.json
+    under the `build` key.
+    List of files in the archive (with their sizes, modes, digests and offsets) is
+    written to NESTROOT/versions/:version/manifest.json.
+    Optionally, delta from the previous version is written to
+    NESTROOT/versions/:version/delta-from-:previous.tar.{ext}, see `pake.nest.delta`.
+
+    Builds are reproducible: members are sorted, their owners are stripped and
+    modification times are set to SOURCE_DATE_EPOCH (or 0).
+    Files are taken from files.json: explicit paths and files matching its glob patterns
+    (expanded at build time, see `pake.config.nest.Files`).
+    Builds are incremental: compressed parts of previous build are reused if their files
+    did not change, see `pake.nest.incremental`.
 
     :param root: root for the nest
+    :param codec: compression codec, see `pake.nest.compress`
+    :param level: compression level (default depends on codec)
+    :param threads: number of compressing threads (default: one per CPU)
+    :param cache: use build cache
+    :param delta: build delta from the previous version
     """
     meta = config.nest.Meta(root)
     files = config.nest.Files(root)
@@ -65,7 +111,11 @@ def build(root, version):
     # checking for all the data required to build the package
     if meta['name'] == '': raise errors.PAKEError('name is not specified')
     if not pyversion.version.valid(version, strict=False): raise errors.InvalidVersionError(version)
-    if not list(files): warnings.warn('creating empty package')
+    # glob patterns are relative to the directory containing the nest
+    members = getmembers(files.expand(os.path.relpath(os.path.dirname(os.path.abspath(root)))))
+    if not members: warnings.warn('creating empty package')
+    codec = compress.getcodec(codec)
+    codec.parselevel(level)
 
     releasepath = os.path.join(root, 'versions', version)
     # raise exception if trying to rebuild a package second time with
@@ -73,19 +123,34 @@ def build(root, version):
     if os.path.isdir(releasepath): raise FileExistsError(releasepath)
     else: os.mkdir(releasepath)
 
-    tarname = os.path.join(releasepath, 'build.tar.xz')
-    package = tarfile.TarFile(name=tarname, mode='w')
-    package.xzopen(name=tarname, mode='w')
-    for f in files:
-        package.add(os.path.normpath(f))
-    if 'install.fsrl' not in [os.path.normpath(i) for i in files]:
+    tarname = os.path.join(releasepath, codec.getarchive())
+    mtime = getmtime()
+    sha256, manifest = incremental.writearchive(root, tarname, members, codec=codec.name, level=level,
+                                                threads=threads, mtime=mtime, cache=cache)
+    if 'install.fsrl' not in members:
         warnings.warn('no installation script included in package {0}-{1}'.format(meta['name'], version))
-    if 'remove.fsrl' not in [os.path.normpath(i) for i in files]:
+    if 'remove.fsrl' not in members:
         warnings.warn('no removal script included in package {0}-{1}'.format(meta['name'], version))
 
-    package.close()
-
+    # files are copied so their journals must be folded back first
+    meta.compact()
+    config.nest.Dependencies(root).compact()
     for name in ['meta.json', 'dependencies.json']:
         shutil.copy(os.path.join(root, name), os.path.join(releasepath, name))
-
-    config.nest.Versions(root).add(version).write()
+    archive = {'codec': codec.name,
+               'archive': codec.getarchive(),
+               'size': os.path.getsize(tarname),
+               'sha256': sha256,
+               }
+    versions = config.nest.Versions(root)
+    if delta and len(versions.content) > 0:
+        previous = versions.content[-1]
+        archive['delta'] = deltas.build(root, previous, version, members, manifest, codec=codec.name, level=level,
+                                        threads=threads, mtime=mtime)
+        if archive['delta'] is None:
+            del archive['delta']
+            warnings.warn('no manifest for version {0}: delta not built'.format(previous))
+    config.nest.Meta(releasepath).set('build', archive).write()
+    config.nest.Manifest(releasepath).set(codec.getarchive(), manifest).write()
+
+    versions.add(version).write()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""Directory scanner used to add files to nests.
+
+Directories are read with `os.scandir()` and ignored directories are pruned
+before the scanner descends into them.
+All patterns are compiled into two regular expressions (one for files, one for directories)
+so the cost of matching does not grow with the number of patterns.
+
+Patterns of skipped paths can be of three kinds:
+
+    * avoid:        regular expressions searched for in paths (as returned by the scanner),
+    * extensions:   extensions of files to skip (without leading dot),
+    * ignore:       gitignore-style globs:
+                    - `*` matches anything but `/`, `?` matches one character, `[...]` matches character class,
+                    - `**` matches any number of directories,
+                    - patterns without `/` match names at any depth, other patterns are anchored
+                      at the scanned directory,
+                    - patterns ending with `/` match only directories,
+                    - negation (`!pattern`) is not supported.
+
+Additionally, scanner can yield only files matching `include` globs (a glob matching
+a directory includes all files inside it).
+
+Example:
+
+    for path in pake.nest.scanner.scan('./ui', avoid=['__pycache__'], extensions=['pyc'], ignore=['*.swp', 'build/']):
+        print(path)
+"""
+
+
+import os
+import re
+
+
+def isanchored(pattern):
+    """Returns True if glob is anchored at the base directory (contains `/` other than the trailing one).
+    """
+    return '/' in pattern.rstrip('/')
+
+
+def getprefix(pattern):
+    """Returns directory (relative to the base directory) that contains every path matched by
+    an anchored glob, i.e. its leading segments without wildcards.
+    Returns None for globs that are not anchored.
+    """
+    if not isanchored(pattern): return None
+    segments = pattern.strip('/').split('/')[:-1]
+    prefix = []
+    for segment in segments:
+        if '*' in segment or '?' in segment or '[' in segment: break
+        prefix.append(segment)
+    return '/'.join(prefix)
+
+
+def translate(pattern, base='', descendants=False):
+    """Translates gitignore-style glob to regular expression matching paths
+    (with `/` as separator) inside base directory.
+
+    :param pattern: glob
+    :param base: directory the pattern is relative to
+    :param descendants: match also paths inside matched directories
+    """
+    anchored = isanchored(pattern)
+    pattern = pattern.strip('/')
+    regexp, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regexp.append('(?:.*/)?')
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regexp.append('.*')
+            i += 2
+            continue
+        if c == '*': regexp.append('[^/]*')
+        elif c == '?': regexp.append('[^/]')
+        elif c == '[' and ']' in pattern[i+2:]:
+            end = pattern.index(']', i+2)
+            chars = pattern[i+1:end]
+            if chars[0] == '!': chars = '^' + chars[1:]
+            regexp.append('[{0}]'.format(chars.replace('\\', '\\\\')))
+            i = end
+        else: regexp.append(re.escape(c))
+        i += 1
+    regexp = ''.join(regexp)
+    if anchored:
+        base = base.replace(os.sep, '/').rstrip('/')
+        prefix = ('^{0}/'.format(re.escape(base)) if base else '^')
+    else:
+        prefix = '(?:^|/)'
+    return '{0}{1}{2}$'.format(prefix, regexp, ('(?:/.*)?' if descendants else ''))
+
+
+class Matcher():
+    """Compiled set of patterns deciding which files and directories are skipped.
+    """
+    def __init__(self, base='', avoid=(), extensions=(), ignore=(), include=()):
+        """
+        :param base: scanned directory (anchored globs are relative to it)
+        :param avoid: regular expressions
+        :param extensions: extensions of files to skip
+        :param ignore: gitignore-style globs
+        :param include: gitignore-style globs of files to yield (default: all files)
+        """
+        files = ['(?:{0})'.format(r) for r in avoid]
+        directories = list(files)
+        if extensions: files.append('\\.(?:{0})$'.format('|'.join([re.escape(e.lstrip('.')) for e in extensions])))
+        for glob in ignore:
+            regexp = translate(glob, base)
+            if not glob.endswith('/'): files.append(regexp)
+            directories.append(regexp)
+        self._files = (re.compile('|'.join(files)) if files else None)
+        self._directories = (re.compile('|'.join(directories)) if directories else None)
+        self._include = None
+        if include: self._include = re.compile('|'.join([translate(glob, base, descendants=True) for glob in include]))
+
+    def skipfile(self, path):
+        """Returns True if file should be skipped.
+        """
+        path = path.replace(os.sep, '/')
+        if self._include is not None and self._include.search(path) is None: return True
+        return self._files is not None and self._files.search(path) is not None
+
+    def skipdir(self, path):
+        """Returns True if directory should not be scanned.
+        """
+        return self._directories is not None and self._directories.search(path.replace(os.sep, '/')) is not None
+
+
+def scan(path, recursive=True, avoid=(), extensions=(), ignore=(), include=(), base=None):
+    """Yields paths of files found in directory (in sorted order).
+    Symbolic links to directories are not followed.
+
+    :param path: directory to scan
+    :param recursive: scan subdirectories
+    :param avoid: regular expressions matching paths to skip
+    :param extensions: extensions of files to skip
+    :param ignore: gitignore-style globs matching paths to skip
+    :param include: gitignore-style globs matching files to yield (default: all files)
+    :param base: directory anchored globs are relative to (default: scanned directory)
+    """
+    matcher = Matcher((path if base is None else base), avoid, extensions, ignore, include)
+    return _scan(path, recursive, matcher)
+
+
+def _scan(directory, recursive, matcher):
+    subdirectories = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        path = os.path.join(directory, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            if recursive and not matcher.skipdir(path): subdirectories.append(path)
+        elif entry.is_file() and not matcher.skipfile(path):
+            yield path
+    for subdirectory in subdirectories:
+        yield from _scan(subdirectory, recursive, matcher)
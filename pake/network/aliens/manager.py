@@ -20,7 +20,7 @@ def fetchalien(url):
     return alien
 
 
-def set(root, url, alien={}, fetch=True):
+def set(root, url, alien={}, fetch=True, session=None):
     """Adds alien node to the list of aliens.json.
     If given url is not of the alien's main node it will be changed.
 
@@ -32,12 +32,18 @@ def set(root, url, alien={}, fetch=True):
     :type alien: dict
     :param fetch: tells the function whether to fetch data
     :type fetch: bool
+    :param session: node config session; if given, alien is set in it and nothing is written
+    :type session: pake.config.session.NodeSession
 
     :returns: dictionary containing fetched alien data
     """
+    aliens = (config.node.Aliens(root) if session is None else session.aliens)
+    # if URL is a mirror of already registered alien use alien's main URL
+    if aliens.resolve(url) is not None: url = aliens.resolve(url)
     if fetch: alien = fetchalien(url)
     if 'mirrors' not in alien: warnings.warn('alien does not contain list of mirrors')
     if 'meta' not in alien: warnings.warn('alien does not contain metadata')
     if url in alien['mirrors']: url = alien['meta']['url']
-    config.node.Aliens(root).set(url=url, mirrors=alien['mirrors'], meta=alien['meta']).write()
+    aliens.set(url=url, mirrors=alien['mirrors'], meta=alien['meta'])
+    if session is None: aliens.write()
     return alien
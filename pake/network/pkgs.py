@@ -5,9 +5,21 @@
 
 import os
 import json
-import urllib
 
-from .. import config, shared
+from .. import config, records
+from ..packages import db
+
+
+def iterlocalpackages(root):
+    """This will generate packages that are local to your network e.g.
+    are provided by your mirrors (as `pake.records.IndexedPackage` objects).
+    This will scan nests.
+    """
+    origin = config.node.Meta(root).get('url')
+    for nest in config.node.Nests(root).iternests():
+        print(nest.name)
+        versions = list(config.nest.Versions(nest.path).content)
+        yield records.IndexedPackage(nest.meta.get('name'), origin, versions=versions)
 
 
 def getlocalindex(root):
@@ -15,22 +27,17 @@ def getlocalindex(root):
     are provided by your mirrors.
     This will scan nests.
     """
-    nests = config.node.Nests(root)
-    index = []
-    errors = []
-    # generate index of local packages
-    for i in nests:
-        print(i)
-        ifsmeta = open(os.path.join(nests[i], 'meta.json'), 'r')
-        ifsversions = open(os.path.join(nests[i], 'versions.json'), 'r')
-        name = json.loads(ifsmeta.read())['name']
-        versions = json.loads(ifsversions.read())
-        origin = config.node.Meta(root).get('url')
-        pack = {'name': name, 'versions': versions, 'origin': origin}
-        ifsmeta.close()
-        ifsversions.close()
-        index.append(pack)
-    return (index, errors)
+    index = [pack.asdict() for pack in iterlocalpackages(root)]
+    return (index, [])
+
+
+def iterpackages(root, errors=None):
+    """This function will generate packages (with their versions) that can be found
+    in the network, as `pake.records.IndexedPackage` objects.
+
+    :param errors: list to which error messages are appended
+    """
+    return db.iterpackages(root, errors, fields=('versions',))
 
 
 def getindex(root):
@@ -39,41 +46,8 @@ def getindex(root):
 
     :returns: two-tuple (pkg-index, list-of-errors)
     """
-    aliens = config.node.Aliens(root)
-    index = []
     errors = []
-    for url in aliens:
-        mirrors = aliens.get(url)['mirrors']
-        for m in mirrors:
-            print('\t', m)
-            try:
-                packages = shared.fetchjson('{0}/packages.json'.format(m))
-                # if fetch was successful break from loop
-                # the assumption is made that mirrors are kept up-to-date and
-                # in sync by the developers
-                break
-            except urllib.error.URLError as e:
-                errors.append('pake: fail: {0}: while getting packages from {1}'.format(e, m))
-                packages = []
-            finally:
-                pass
-        for m in mirrors:
-            indexpart = []
-            for name in packages:
-                pack = {'name': name, 'origin': url}
-                print('trying package: {0}'.format(name))
-                for i in ['versions']:
-                    print('\tfrom mirror: {0}'.format(m))
-                    resource = '{0}/packages/{1}/{2}.json'.format(m, name, i)
-                    try:
-                        pack[i] = shared.fetchjson(resource)
-                        indexpart.append(pack)
-                        print(pack)
-                    except (urllib.error.HTTPError, urllib.error.URLError) as e:
-                        errors.append('{0}: {1}'.format(e, resource))
-                    finally:
-                        pass
-            index.extend(indexpart)
+    index = [pack.asdict() for pack in iterpackages(root, errors)]
     return (index, errors)
 
 
@@ -5,3 +5,4 @@
 from . import manager
 from . import pusher
 from . import packages
+from . import builder
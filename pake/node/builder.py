@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""Batch building of nests registered in the node.
+
+Nests are built on a pool of processes (every build changes working directory to
+the directory containing its nest, which cannot be done by threads).
+Failure of one build does not stop the others; errors are collected and reported
+together with wall-clock time of every build.
+
+Example:
+
+    results = pake.node.builder.build(root, jobs=4)
+    pake.node.builder.report(results)
+"""
+
+
+import concurrent.futures
+import os
+import time
+
+from .. import config
+from ..nest import compress
+from ..nest import package
+
+
+class Result():
+    """Result of building one nest.
+    """
+    __slots__ = ('name', 'path', 'version', 'time', 'error')
+
+    def __init__(self, name, path, version, time=0.0, error=None):
+        self.name = name
+        self.path = path
+        self.version = version
+        self.time = time
+        self.error = error
+
+    def __repr__(self):
+        return 'Result({0!r}, {1!r}, error={2!r})'.format(self.name, self.version, self.error)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _build(name, path, version, options):
+    """Builds one nest.
+    Runs in worker process.
+    """
+    start = time.perf_counter()
+    error = None
+    cwd = os.getcwd()
+    try:
+        # paths in files.json are relative to the directory containing the nest
+        os.chdir(os.path.dirname(path))
+        package.build(path, version, **options)
+    except Exception as e:
+        error = '{0}: {1}'.format(type(e).__name__, e)
+    finally:
+        os.chdir(cwd)
+    return Result(name, path, version, time.perf_counter() - start, error)
+
+
+def getversions(root, names=None):
+    """Returns list of (name, path, version) tuples for nests to build.
+    Version of every nest is taken from its metadata.
+
+    :param root: root of the node
+    :param names: names of nests to build (default: all registered nests)
+    """
+    nests = config.node.Nests(root)
+    if names is None: names = sorted(nests.names())
+    builds = []
+    for name in names:
+        if name not in nests:
+            builds.append((name, None, None))
+            continue
+        path = os.path.abspath(os.path.expanduser(nests.get(name)))
+        meta = config.nest.Meta(path)
+        # nests without version fail to build (and are reported) but do not stop the batch
+        builds.append((name, path, (meta.get('version') if 'version' in meta else None)))
+    return builds
+
+
+def build(root, names=None, versions=None, jobs=None, codec='xz', level=None, cache=True, delta=False):
+    """Builds registered nests in parallel.
+
+    :param root: root of the node
+    :param names: names of nests to build (default: all registered nests)
+    :param versions: dictionary mapping names of nests to versions to build (default: version from meta of the nest)
+    :param jobs: maximal number of concurrent builds (default: one per CPU)
+    :returns: list of Result objects (in order of names)
+    """
+    builds = getversions(root, names)
+    if versions is not None: builds = [(name, path, versions.get(name, version)) for name, path, version in builds]
+    jobs = min(compress.getthreads(jobs), max(len(builds), 1))
+    # compressing threads are divided between builds so CPUs are not oversubscribed
+    options = {'codec': codec, 'level': level, 'cache': cache, 'delta': delta,
+               'threads': max(1, compress.getthreads() // jobs)}
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [(pool.submit(_build, name, path, version, options) if path else None)
+                   for name, path, version in builds]
+        for (name, path, version), future in zip(builds, futures):
+            if future is None:
+                results.append(Result(name, path, version, error='nest is not registered'))
+                continue
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # worker process died
+                results.append(Result(name, path, version, error='{0}: {1}'.format(type(e).__name__, e)))
+    return results
+
+
+def report(results, wall=None):
+    """Prints summary of batch build.
+
+    :param results: list of Result objects
+    :param wall: total wall-clock time of the batch
+    """
+    for result in results:
+        status = ('OK' if result.ok else 'failed: {0}'.format(result.error))
+        print('* {0} {1}: {2:.2f}s: {3}'.format(result.name, result.version, result.time, status))
+    failed = len([result for result in results if not result.ok])
+    summary = 'pake: built {0} of {1} nest(s)'.format(len(results) - failed, len(results))
+    if wall is not None: summary += ' in {0:.2f}s'.format(wall)
+    print(summary)
@@ -27,19 +27,22 @@ def _check(meta, path):
             raise errors.PAKEError('missing information for nest in: {0}: {1}'.format(path, key))
 
 
-def register(root, path):
+def register(root, path, session=None):
     """Register PAKE nest in the node. This will allow to
     push the package provided to the Net.
 
     :param root: path to the root of your node
     :param path: path to the root of the nest being registered
+    :param session: node config session; if given, nest is registered in it and nothing is written
     """
     if not os.path.isabs(path):
         warnings.warn('path {0} is not absolute'.format(path))
         path = os.path.abspath(path)  # make the path absolute
     meta = config.nest.Meta(os.path.join(path, '.pakenest'))
     _check(meta.content, path)
-    config.node.Nests(root).set(name=meta.get('name'), path=os.path.join(path, '.pakenest')).write()
+    nests = (config.node.Nests(root) if session is None else session.nests)
+    nests.set(name=meta.get('name'), path=os.path.join(path, '.pakenest'))
+    if session is None: nests.write()
 
 
 def unregister(root, name):
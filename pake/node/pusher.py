@@ -1,140 +1,764 @@
 #!/usr/bin/env python3
 
 """File used for pushing local node to its mirrors.
+
+Pushes to many mirrors are run concurrently (see `pushall()`): every mirror is
+pushed in its own thread, so total time of a push is
+close to the time of the slowest mirror instead of sum of times of all of them.
+Failure of one mirror does not stop pushes to the others.
+
+Every mirror is pushed over a pool of FTP sessions (see `Pool`) using absolute remote paths,
+so independent files are uploaded concurrently.
+
+Only files that are missing on a mirror or differ from local ones are uploaded:
+mirrors keep `push-manifest.json` with sizes and SHA-256 digests of pushed files (see `PushManifest`).
+
+Uploads are resumable (see `FTPPusher.resumebinary()`) and retried with backoff when
+connection drops; files that could not be uploaded do not stop the rest of the push.
+
+Example:
+
+    results = pake.node.pusher.pushall(root, {url: (username, password)}, jobs=4)
+    pake.node.pusher.report(results)
 """
 
 
+import calendar
+import concurrent.futures
+import contextlib
 import ftplib
+import functools
+import io
 import json
 import os
+import posixpath
+import queue
+import socket
+import threading
+import time
 import warnings
 
-from .. import config
+from .. import config, errors, shared
+from ..nest import compress
 
 
 class FTPPusher(ftplib.FTP):
     """Wrapper around ftplib's FTP object.
     """
-    def sendlines(self, path):
+    def sendlines(self, path, remote=None):
         """Send file as lines.
-        File is sent to the current working directory set in remote.
+        File is sent to the current working directory set in remote unless
+        remote path is given.
 
         :param path: path to a file to be sent
+        :param remote: remote path of the file
         """
         ifstream = open(path, 'rb')
-        self.storlines('STOR {0}'.format(os.path.split(path)[-1]), ifstream, callback=None)
+        self.storlines('STOR {0}'.format(remote or os.path.split(path)[-1]), ifstream, callback=None)
         ifstream.close()
         return self
 
-    def sendbinary(self, path):
+    def sendbinary(self, path, remote=None):
         """Send file as binary.
-        File is sent to the current working directory set in remote.
+        File is sent to the current working directory set in remote unless
+        remote path is given.
 
         :param path: path to a file to be sent
+        :param remote: remote path of the file
         """
         ifstream = open(path, 'rb')
-        self.storbinary('STOR {0}'.format(os.path.split(path)[-1]), ifstream, callback=None)
+        self.storbinary('STOR {0}'.format(remote or os.path.split(path)[-1]), ifstream, callback=None)
         ifstream.close()
         return self
 
+    def remotesize(self, remote):
+        """Returns size of remote file or None if it does not exist.
+        """
+        self.voidcmd('TYPE I')
+        try:
+            return self.size(remote)
+        except ftplib.error_perm:
+            return None
+
+    def resumebinary(self, path, remote, partial=None):
+        """Send file as binary, resuming interrupted upload.
+        File is uploaded as partial file and renamed to remote path once its size is verified.
+        If partial file is already on the server, upload continues from its end (using REST, or
+        APPE if the server does not support REST for STOR).
+        Name of partial file must be unique for contents of the file (e.g. contain its digest), so
+        stale partial uploads are never continued (they are removed by pushes, see `_removestale()`).
+
+        :param path: path to a file to be sent
+        :param remote: remote path of the file
+        :param partial: remote path of partial file (default: remote path with `.part` suffix)
+        :returns: offset the upload was resumed from
+        """
+        if partial is None: partial = remote + '.part'
+        size = os.path.getsize(path)
+        offset = self.remotesize(partial) or 0
+        if offset > size:
+            self.delete(partial)
+            offset = 0
+        if offset < size or offset == 0:
+            ifstream = open(path, 'rb')
+            try:
+                ifstream.seek(offset)
+                if offset == 0:
+                    self.storbinary('STOR {0}'.format(partial), ifstream)
+                else:
+                    try:
+                        self.storbinary('STOR {0}'.format(partial), ifstream, rest=offset)
+                    except ftplib.error_perm:
+                        ifstream.seek(offset)
+                        self.storbinary('APPE {0}'.format(partial), ifstream)
+            finally:
+                ifstream.close()
+        uploaded = self.remotesize(partial)
+        if uploaded != size:
+            raise ftplib.error_temp('451 uploaded {0} of {1} bytes: {2}'.format(uploaded, size, remote))
+        try:
+            self.rename(partial, remote)
+        except ftplib.error_perm:
+            # some servers do not overwrite existing files when renaming
+            self.delete(remote)
+            self.rename(partial, remote)
+        return offset
+
+    def listdir(self, directory='.'):
+        """Returns dictionary mapping names of entries of the directory to
+        their facts (type, size and modification time) as returned by .mlsd().
+        Although .nlst() method is deprecated some servers (VSFTPd for example) don't accept
+        .mlsd(). In such situations this method issues a warning and falls back to .nlst()
+        (facts are empty then).
+        """
+        try:
+            return dict(self.mlsd(directory, facts=['type', 'size', 'modify']))
+        except ftplib.error_perm as e:
+            warnings.warn('\'{0}\' was returned by .mlsd(): trying to use deprecated .nlst()'.format(e))
+            # some servers return full paths of listed files
+            return dict([(posixpath.basename(name), {}) for name in self.nlst(directory)])
+
     def ls(self, directory='.'):
         """Returns directory listing.
-        Although .nlst() method is deprecated some servers (VSFTPd for example) don't accept
-        .mlsd(). In such situations this method issues a warning and falls back to .nlst().
         Returns a list of strings.
         """
         listing = []
         try:
-            listing = [name for name, data in self.mlsd(directory)]
-        except ftplib.error_perm as e:
-            warnings.warn('\'{0}\' was returned by .mlsd(): trying to use deprecated .nlst()'.format(e))
-            listing = self.nlst(directory)
+            listing = list(self.listdir(directory))
         finally:
             return listing
 
 
+class Listings():
+    """Cache of remote directory listings kept for the duration of a push.
+
+    Every directory is listed at most once; listings are updated when directories are
+    created and files uploaded so they never have to be listed again.
+    Listings map names of entries to their facts (see FTPPusher.listdir()).
+    """
+    def __init__(self, pool):
+        self.pool = pool
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, directory, remote=None):
+        """Returns listing of remote directory.
+        Missing directory is listed as empty.
+
+        :param directory: absolute remote path
+        :param remote: session to use (default: one taken from the pool)
+        """
+        with self._lock: listing = self._cache.get(directory)
+        if listing is not None: return listing
+        if remote is None:
+            with self.pool.session() as remote: return self.get(directory, remote)
+        try:
+            listing = remote.listdir(directory)
+        except ftplib.error_perm:
+            listing = {}
+        with self._lock: return self._cache.setdefault(directory, listing)
+
+    def has(self, path, remote=None):
+        """Returns True if remote path exists.
+        """
+        directory, name = posixpath.split(path)
+        return name in self.get(directory, remote)
+
+    def add(self, path, facts=None):
+        """Records remote path as existing (if its directory was already listed).
+        """
+        directory, name = posixpath.split(path)
+        with self._lock:
+            if directory in self._cache: self._cache[directory][name] = (facts or {})
+
+    def remove(self, path):
+        """Records remote path as removed.
+        """
+        directory, name = posixpath.split(path)
+        with self._lock:
+            if directory in self._cache: self._cache[directory].pop(name, None)
+
+    def mkd(self, remote, path):
+        """Creates remote directory.
+        """
+        remote.mkd(path)
+        self.add(path, {'type': 'dir'})
+        with self._lock: self._cache[path] = {}
+
+    def prefetch(self, depth=3):
+        """Lists the tree of remote directories starting from the root of the mirror, one level at a time;
+        directories of every level are listed concurrently using all sessions of the pool.
+
+        :param depth: number of levels of subdirectories listed (default covers all directories
+                      consulted during a push: root, packages/, packages/:name/ and packages/:name/versions/)
+        """
+        # root of the mirror is known once a session is opened
+        with self.pool.session(): level = [self.pool.path()]
+        while level:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.pool.size, len(level))) as executor:
+                listings = list(executor.map(self.get, level))
+            if depth == 0: break
+            depth -= 1
+            level = [posixpath.join(directory, name) for directory, listing in zip(level, listings)
+                     for name, facts in sorted(listing.items()) if facts.get('type') == 'dir']
+
+
+class Pool():
+    """Pool of logged-in FTP sessions with one mirror.
+
+    Sessions are opened lazily (up to the size of the pool) and every one of them starts
+    in the root of the mirror; absolute path of the root is available as `root` attribute once
+    the first session is opened.
+    A session is used by one thread at a time.
+    Sessions that failed are closed instead of being returned to the pool.
+    Remote directory listings are cached in `listings` attribute for the lifetime of the pool.
+    """
+    def __init__(self, host, username, password, cwd='', size=4):
+        """
+        :param host: FTP server
+        :param username: FTP server username
+        :param password: FTP password
+        :param cwd: directory to which PAKE will go after logging in
+        :param size: maximal number of open sessions
+        """
+        self.host = host
+        self.username = username
+        self.password = password
+        self.cwd = cwd
+        self.size = max(1, size)
+        self.root = None
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+        self.listings = Listings(self)
+        self.manifest = PushManifest(self)
+
+    def _connect(self):
+        remote = FTPPusher(self.host)
+        try:
+            remote.login(self.username, self.password)
+            if self.cwd: remote.cwd(self.cwd)
+            if self.root is None: self.root = remote.pwd()
+        except BaseException:
+            remote.close()
+            raise
+        return remote
+
+    def acquire(self):
+        """Returns idle session, opening new one if the pool is not full.
+        Blocks until a session is available.
+        """
+        with self._lock:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                connect = self._opened < self.size
+                if connect: self._opened += 1
+        if not connect: return self._idle.get()
+        try:
+            return self._connect()
+        except BaseException:
+            with self._lock: self._opened -= 1
+            raise
+
+    def release(self, remote, broken=False):
+        """Returns session to the pool.
+
+        :param broken: close the session instead
+        """
+        if not broken: return self._idle.put(remote)
+        with self._lock: self._opened -= 1
+        remote.close()
+
+    @contextlib.contextmanager
+    def session(self):
+        """Context manager acquiring session from the pool.
+        """
+        remote = self.acquire()
+        try:
+            yield remote
+        except BaseException:
+            self.release(remote, broken=True)
+            raise
+        self.release(remote)
+
+    def path(self, *parts):
+        """Returns absolute remote path inside the root of the mirror.
+        """
+        return posixpath.join(self.root, *parts)
+
+    def close(self):
+        """Quits idle sessions.
+        """
+        while True:
+            try:
+                remote = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock: self._opened -= 1
+            try:
+                remote.quit()
+            except ftplib.all_errors:
+                remote.close()
+
+
+class PushManifest():
+    """Manifest of files pushed to a mirror, kept in its root as `push-manifest.json`:
+
+        {"packages/foo/versions.json": {"size": 1024, "sha256": "..."}, ...}
+
+    Paths are relative to the root of the mirror.
+    Manifest is downloaded when push starts and compared with local files so only
+    changed or missing files are uploaded; entries of uploaded files are updated and
+    the manifest is uploaded again when push ends.
+    """
+    name = 'push-manifest.json'
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.files = {}
+        self.modified = False
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _relpath(self, remotepath):
+        return posixpath.relpath(remotepath, self.pool.root)
+
+    def load(self, remote):
+        """Downloads manifest from the mirror.
+        Missing or broken manifest is treated as empty one.
+        """
+        buffer = io.BytesIO()
+        try:
+            remote.retrbinary('RETR {0}'.format(self.pool.path(self.name)), buffer.write)
+            self.files = json.loads(buffer.getvalue().decode('utf-8'))
+        except ftplib.error_perm:
+            self.files = {}
+        except ValueError as e:
+            warnings.warn('broken {0} on mirror: {1}'.format(self.name, e))
+            self.files = {}
+        return self
+
+    def get(self, remotepath):
+        """Returns entry for remote path or None.
+        """
+        with self._lock: return self.files.get(self._relpath(remotepath))
+
+    def set(self, remotepath, state):
+        """Sets entry for remote path.
+        """
+        with self._lock:
+            self.files[self._relpath(remotepath)] = state
+            self.modified = True
+        return self
+
+    def expect(self, remotepath, state):
+        """Remembers state of a file that is going to be uploaded;
+        its entry is set once the upload succeeds (see commit()).
+        """
+        with self._lock: self._pending[self._relpath(remotepath)] = state
+        return self
+
+    def commit(self, remotepath):
+        """Sets entry of uploaded file.
+        """
+        with self._lock:
+            state = self._pending.pop(self._relpath(remotepath), None)
+            if state is None: return self
+            self.files[self._relpath(remotepath)] = state
+            self.modified = True
+        return self
+
+    def save(self, remote):
+        """Uploads manifest to the mirror (if it was modified).
+        """
+        with self._lock:
+            if not self.modified: return self
+            data = json.dumps(self.files, sort_keys=True).encode('utf-8')
+            self.modified = False
+        remote.storbinary('STOR {0}'.format(self.pool.path(self.name)), io.BytesIO(data))
+        self.pool.listings.add(self.pool.path(self.name), {'type': 'file'})
+        return self
+
+
+# errors after which uploads are retried (dropped connections, timeouts, busy servers);
+# local errors (e.g. unreadable files) are not
+TRANSIENT = (ftplib.error_temp, ConnectionError, TimeoutError, socket.timeout, EOFError)
+RETRIES = 4
+BACKOFF = 1.0
+# smaller files are sent at once (resuming them costs more round trips than it saves)
+RESUMABLE = 1024 * 1024
+
+
 # Class methods
-def _uploadconfig(root, remote):
+def _send(pool, path, remote, sha256, log=print):
+    """Uploads one file, retrying with exponential backoff on transient errors.
+    Every attempt resumes upload of big files from the last byte confirmed by the server.
+    """
+    # files are sent in binary mode so mirrors hold exact copies of them
+    # (sizes and digests in push manifest match remote files)
+    partial = '{0}.{1}.part'.format(remote, sha256[:16])
+    resumable = os.path.getsize(path) >= RESUMABLE
+    offset = 0
+    for attempt in range(RETRIES + 1):
+        try:
+            with pool.session() as session:
+                if resumable: offset = session.resumebinary(path, remote, partial)
+                else: session.sendbinary(path, remote)
+            break
+        except TRANSIENT as e:
+            if attempt == RETRIES: raise
+            delay = BACKOFF * 2 ** attempt
+            log('+ pake: debug: uploading "{0}" failed: {1}: retrying in {2:.0f}s'.format(remote, e, delay))
+            time.sleep(delay)
+    pool.listings.add(remote, {'type': 'file'})
+    pool.manifest.commit(remote)
+    if offset: log('+ pake: debug: uploaded "{0}" (resumed at byte {1})'.format(remote, offset))
+    else: log('+ pake: debug: uploaded "{0}"'.format(remote))
+    if resumable:
+        try:
+            with pool.session() as session: _removestale(pool, session, remote, partial)
+        except ftplib.all_errors as e:
+            log('+ pake: debug: could not remove partial uploads of "{0}": {1}'.format(remote, e))
+
+
+def _removestale(pool, remote, path, partial):
+    """Removes partial uploads of a file left by earlier pushes (interrupted, or of
+    previous content of the file).
+
+    :param remote: session to use
+    :param path: remote path of the file
+    :param partial: remote path of the partial file that was just completed
+    """
+    directory, name = posixpath.split(path)
+    stale = [entry for entry in list(pool.listings.get(directory, remote))
+             if entry.startswith(name + '.') and entry.endswith('.part') and entry != posixpath.basename(partial)]
+    for entry in stale:
+        remote.delete(posixpath.join(directory, entry))
+        pool.listings.remove(posixpath.join(directory, entry))
+
+
+def _transfer(pool, uploads, log=print):
+    """Uploads files concurrently, using all sessions of the pool.
+    Every file is uploaded even if some of them fail.
+
+    :param pool: pool of sessions
+    :param uploads: list of three-tuples (local-path, remote-path, sha256)
+    :returns: list of two-tuples (remote-path, exception) for files that could not be uploaded
+    """
+    if not uploads: return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(pool.size, len(uploads))) as executor:
+        futures = [(remote, executor.submit(_send, pool, path, remote, sha256, log))
+                   for path, remote, sha256 in uploads]
+        failed = [(remote, future.exception()) for remote, future in futures if future.exception() is not None]
+    for remote, e in failed: log('+ pake: debug: could not upload "{0}": {1}'.format(remote, e))
+    return failed
+
+
+def _getstate(path, sha256=None):
+    """Returns manifest entry for local file.
+
+    :param sha256: digest of the file if it is already known
+    """
+    return {'size': os.path.getsize(path), 'sha256': (sha256 or shared.filedigest(path))}
+
+
+def _unchanged(pool, remote, path, remotepath, state):
+    """Returns True if remote file is the same as the local one.
+    Files without entry in push manifest (i.e. pushed before manifests were used) are
+    compared by size and modification time (taken from directory listing, or
+    SIZE and MDTM commands if the server does not support MLSD).
+    """
+    entry = pool.manifest.get(remotepath)
+    if entry is not None: return entry == state
+    directory, name = posixpath.split(remotepath)
+    facts = pool.listings.get(directory, remote).get(name)
+    if facts is None: return False
+    size, modify = facts.get('size'), facts.get('modify')
+    try:
+        if size is None:
+            remote.voidcmd('TYPE I')
+            size = remote.size(remotepath)
+        if modify is None: modify = remote.sendcmd('MDTM {0}'.format(remotepath)).split()[-1]
+    except ftplib.error_perm:
+        return False
+    if size is None or int(size) != state['size']: return False
+    try:
+        mtime = calendar.timegm(time.strptime(modify[:14], '%Y%m%d%H%M%S'))
+    except ValueError:
+        return False
+    return mtime >= int(os.path.getmtime(path))
+
+
+def _select(pool, remote, candidates, reupload=False):
+    """Returns list of files that must be uploaded: missing on the mirror or different from
+    local ones (all of them if reupload is requested).
+
+    :param remote: session used for listings
+    :param candidates: list of three-tuples (local-path, remote-path, sha256-or-None)
+    :returns: list of three-tuples (local-path, remote-path, sha256)
+    """
+    uploads = []
+    for path, remotepath, sha256 in candidates:
+        state = _getstate(path, sha256)
+        if reupload or not _unchanged(pool, remote, path, remotepath, state):
+            pool.manifest.expect(remotepath, state)
+            uploads.append((path, remotepath, state['sha256']))
+        elif pool.manifest.get(remotepath) is None:
+            # found on the mirror by size and modification time
+            pool.manifest.set(remotepath, state)
+    return uploads
+
+
+def _uploadconfig(root, pool, reupload=False, log=print):
     """Uploads configuration files from ~/.pakenode to the
     root of a mirror. Root of a mirror is set by "cwd" field in pusher.
 
-    :param remote: is a ftplib.FTP object capable of storing files
+    :param pool: pool of sessions with the mirror
     :param root: root of the node
+    :returns: list of files that could not be uploaded, see _transfer()
     """
     files = ['meta.json', 'packages.json', 'aliens.json', 'mirrors.json']
-    for name in files: remote.sendlines(path=os.path.join(root, name))
+    with pool.session() as remote:
+        uploads = _select(pool, remote, [(os.path.join(root, name), pool.path(name), None) for name in files], reupload)
+    return _transfer(pool, uploads, log)
 
 
-def _uploadpackages(root, remote, reupload=False):
+def _uploadpackages(root, pool, reupload=False, log=print, prefetch=False):
     """Uploads packages.
+    Directories are created over one session and then files of all versions are uploaded
+    concurrently; `versions.json` files are uploaded last so mirrors do not advertise
+    versions before their files are in place (`versions.json` of a package is not uploaded
+    if any file of the package failed).
+    Every remote directory is listed at most once (see Listings).
 
-    :param remote: is a ftplib.FTP object capable of storing files
+    :param pool: pool of sessions with the mirror
+    :param log: function called with progress messages
+    :param prefetch: list remote directories up front, concurrently
+    :returns: list of files that could not be uploaded, see _transfer()
     """
-    for name in ['packages', 'cache']:
-        if name not in remote.ls(): remote.mkd(name)
-    remote.cwd('./packages')
+    candidates, indexes = [], []
     pkgs = config.node.Nests(root)
-    for name in pkgs:
-        print('+ pake: debug: uploading: {0}'.format(name))
-        if name not in remote.ls():
-            print('+ pake: debug: creating "{0}" directory'.format(name))
-            remote.mkd(name)
-        print('+ pake: debug: switching to "{0}" directory'.format(name))
-        remote.cwd('./{0}'.format(name))
-        remote.sendlines(path=os.path.join(pkgs.get(name), 'versions.json'))
-        print('+ pake: debug: uploaded "versions.json" file')
-        if 'versions' not in remote.ls():
-            print('+ pake: debug: creating "versions" directory'.format(name))
-            remote.mkd('versions')
-        print('+ pake: debug: switching to "versions" directory'.format(name))
-        remote.cwd('./versions')
-        versions = config.nest.Versions(pkgs.get(name))
-        for v in versions:
-            absent = v not in remote.ls()
-            if absent or reupload:
-                print('+ pake: debug: creating "versions/{0}" directory'.format(v))
-                if absent: remote.mkd(v)
-                remote.cwd(v)
-                for conffile in ['meta.json', 'dependencies.json']:
-                    print('+ pake: debug: uploading "{0}" for version {1}'.format(conffile, v))
-                    remote.sendlines(path=os.path.join(pkgs.get(name), 'versions', v, conffile))
-                print('+ pake: debug: uploading build for version {0}'.format(v))
-                remote.sendbinary(path=os.path.join(pkgs.get(name), 'versions', v, 'build.tar.xz'))
-        print('+ pake: debug: uploaded package: {0}'.format(name))
-        remote.cwd('../../')
-        print('+ pake: debug: returning to main package directory...')
-
-
-def _upload(root, host, username, password, cwd='', reupload=False):
+    listings = pool.listings
+    if prefetch: listings.prefetch()
+    with pool.session() as remote:
+        for name in ['packages', 'cache']:
+            if not listings.has(pool.path(name), remote): listings.mkd(remote, pool.path(name))
+        for name in pkgs:
+            log('+ pake: debug: uploading: {0}'.format(name))
+            if not listings.has(pool.path('packages', name), remote):
+                log('+ pake: debug: creating "{0}" directory'.format(name))
+                listings.mkd(remote, pool.path('packages', name))
+            indexes.append((os.path.join(pkgs.get(name), 'versions.json'),
+                            pool.path('packages', name, 'versions.json'), None))
+            if not listings.has(pool.path('packages', name, 'versions'), remote):
+                log('+ pake: debug: creating "versions" directory'.format(name))
+                listings.mkd(remote, pool.path('packages', name, 'versions'))
+            versions = config.nest.Versions(pkgs.get(name))
+            for v in versions:
+                remotepath = pool.path('packages', name, 'versions', v)
+                if not listings.has(remotepath, remote):
+                    log('+ pake: debug: creating "versions/{0}" directory'.format(v))
+                    listings.mkd(remote, remotepath)
+                releasepath = os.path.join(pkgs.get(name), 'versions', v)
+                for conffile in ['meta.json', 'dependencies.json', 'manifest.json']:
+                    # versions built before manifests were introduced do not have them
+                    if not os.path.isfile(os.path.join(releasepath, conffile)): continue
+                    candidates.append((os.path.join(releasepath, conffile), posixpath.join(remotepath, conffile), None))
+                meta = config.nest.Meta(releasepath)
+                build = (meta.get('build') if 'build' in meta else {})
+                # digests of archives are recorded when they are built
+                archive = compress.getarchive(meta)
+                candidates.append((os.path.join(releasepath, archive), posixpath.join(remotepath, archive),
+                                   build.get('sha256')))
+                delta = build.get('delta')
+                if delta:
+                    candidates.append((os.path.join(releasepath, delta['archive']),
+                                       posixpath.join(remotepath, delta['archive']), delta['sha256']))
+        uploads, updated = _select(pool, remote, candidates, reupload), _select(pool, remote, indexes, reupload)
+    log('+ pake: debug: {0} of {1} file(s) changed'.format(len(uploads) + len(updated), len(candidates) + len(indexes)))
+    failed = _transfer(pool, uploads, log)
+    broken = set([posixpath.relpath(remote, pool.path('packages')).split('/')[0] for remote, e in failed])
+    indexes = []
+    for path, remote, sha256 in updated:
+        if posixpath.basename(posixpath.dirname(remote)) not in broken: indexes.append((path, remote, sha256))
+        else: log('+ pake: debug: not uploading "{0}": some files of the package failed'.format(remote))
+    return failed + _transfer(pool, indexes, log)
+
+
+def _upload(root, host, username, password, cwd='', reupload=False, log=print, connections=4, prefetch=False):
     """Uploads node data to given host.
+    Configuration files are uploaded after packages so mirror does not advertise
+    packages before they are in place.
+    Push manifest is uploaded at the end, even if some uploads failed.
+    Files that could not be uploaded do not stop the push; PushError is raised at the end.
 
     :root: root directory of the local node
     :host: url of host server
     :username: FTP server username
     :passowrd: FTP password
     :cwd: directory to which PAKE will go after logging in
+    :reupload: upload all files, even if they did not change
+    :log: function called with progress messages
+    :connections: number of concurrent FTP sessions
+    :prefetch: list remote directories up front
+    """
+    pool = Pool(host, username, password, cwd, size=connections)
+    try:
+        with pool.session() as remote: pool.manifest.load(remote)
+        try:
+            failed = _uploadpackages(root, pool, reupload=reupload, log=log, prefetch=prefetch)
+            failed += _uploadconfig(root, pool, reupload=reupload, log=log)
+        except BaseException:
+            # files that were uploaded need not be uploaded again
+            try:
+                with pool.session() as remote: pool.manifest.save(remote)
+            except Exception as e:
+                log('+ pake: debug: could not upload {0}: {1}'.format(PushManifest.name, e))
+            raise
+        with pool.session() as remote: pool.manifest.save(remote)
+    finally:
+        pool.close()
+    if failed:
+        remote, e = failed[0]
+        raise errors.PushError('{0} file(s) could not be uploaded: {1}: {2}'.format(len(failed), remote, e))
+
+
+def prepare(root):
+    """Prepares node for pushing.
+    JSON files sent to mirrors must be regenerated from the database
+    or have their journals folded back.
+
+    :param root: node root directory
     """
-    remote = FTPPusher(host)
-    remote.login(username, password)
-    if cwd: remote.cwd(cwd)
-    _uploadconfig(root, remote)
-    _uploadpackages(root, remote, reupload=reupload)
-    remote.close()
+    if config.sqlite.enabled(root): config.sqlite.export(root)
+    else:
+        config.node.Meta(root).compact()
+        config.node.Aliens(root).compact()
 
 
-def push(root, url, username, password, reupload=False):
+def _push(root, url, username, password, log=print, **options):
+    pusher = config.node.Pushers(root).get(url)
+    if pusher is None: raise Exception('no pusher found for URL: {0}'.format(url))
+    _upload(root, host=pusher['host'], username=username, password=password, cwd=pusher['cwd'], log=log, **options)
+
+
+def push(root, url, username, password, reupload=False, connections=4, prefetch=False):
     """Pushes node to remote server.
 
     :param root: node root directory
     :param url: URL of a mirror from which data should be taken
     :param username: username for the server
     :param password: password for the server
+    :param connections: number of concurrent FTP sessions with the server
+    :param prefetch: list remote directories up front
     """
-    pusher = config.node.Pushers(root).get(url)
-    if pusher is None: raise Exception('no pusher found for URL: {0}'.format(url))
-    host = pusher['host']
-    cwd = pusher['cwd']
-    _upload(root, host=host, username=username, password=password, cwd=cwd, reupload=reupload)
+    prepare(root)
+    _push(root, url, username, password, reupload=reupload, connections=connections, prefetch=prefetch)
+
+
+class Result():
+    """Result of pushing to one mirror.
+    """
+    __slots__ = ('url', 'time', 'error', 'exception')
+
+    def __init__(self, url, time=0.0, exception=None):
+        self.url = url
+        self.time = time
+        self.exception = exception
+        self.error = (None if exception is None else '{0} (cause: {1})'.format(exception, type(exception).__name__))
+
+    def __repr__(self):
+        return 'Result({0!r}, error={1!r})'.format(self.url, self.error)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+_printlock = threading.Lock()
+
+
+def _progress(url, message):
+    """Default progress reporter: prints messages prefixed with URL of the mirror.
+    """
+    with _printlock: print('[{0}] {1}'.format(url, message))
+
+
+def _pushone(root, url, username, password, options, progress):
+    start = time.perf_counter()
+    log = functools.partial(progress, url)
+    exception = None
+    try:
+        log('pushing...')
+        _push(root, url, username, password, log=log, **options)
+    except Exception as e:
+        exception = e
+    result = Result(url, time.perf_counter() - start, exception)
+    log('OK' if result.ok else 'failed: {0}'.format(result.error))
+    return result
+
+
+def pushall(root, credentials, reupload=False, jobs=None, progress=None, connections=4, prefetch=False):
+    """Pushes node to many mirrors concurrently.
+    Every mirror gets its own thread and pool of FTP sessions.
+
+    :param root: node root directory
+    :param credentials: dictionary mapping URLs of mirrors to two-tuples (username, password), or
+                        list of three-tuples (url, username, password)
+    :param reupload: reupload all package files
+    :param jobs: maximal number of mirrors pushed at the same time (default: all of them)
+    :param progress: function called with URL of a mirror and a progress message (default: prints them)
+    :param connections: number of concurrent FTP sessions with every mirror
+    :param prefetch: list remote directories up front
+    :returns: list of Result objects (in order of credentials)
+    """
+    if type(credentials) is dict:
+        credentials = [(url, username, password) for url, (username, password) in credentials.items()]
+    if not credentials: return []
+    if progress is None: progress = _progress
+    prepare(root)
+    jobs = min((jobs or len(credentials)), len(credentials))
+    options = {'reupload': reupload, 'connections': connections, 'prefetch': prefetch}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_pushone, root, url, username, password, options, progress)
+                   for url, username, password in credentials]
+        return [future.result() for future in futures]
+
+
+def report(results, wall=None):
+    """Prints summary of a push.
+
+    :param results: list of Result objects
+    :param wall: total wall-clock time of the push
+    """
+    for result in results:
+        status = ('OK' if result.ok else 'failed: {0}'.format(result.error))
+        print('* pushing to mirror {0}: {1:.2f}s: {2}'.format(result.url, result.time, status))
+    failed = len([result for result in results if not result.ok])
+    summary = 'pake: pushed to {0} of {1} mirror(s)'.format(len(results) - failed, len(results))
+    if wall is not None: summary += ' in {0:.2f}s'.format(wall)
+    print(summary)
 
 
 def genmirrorlist(root):
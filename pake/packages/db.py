@@ -7,49 +7,59 @@ import os
 import json
 import urllib
 
-from .. import config, shared
+from .. import config, records, shared
 
 
-def getindex(root):
-    """This function will generate and return index of packages that can be found
-    in the network.
-
-    :returns: two-tuple (pkg-index, list-of-errors)
+def _fetchpackages(mirrors, errors):
+    """Returns list of packages provided by the first mirror that responded.
     """
-    aliens = config.node.Aliens(root)
-    index = []
-    errors = []
-    for url in aliens:
-        mirrors = aliens.get(url)['mirrors']
-        for m in mirrors:
-            print('\t', m)
-            try:
-                packages = shared.fetchjson('{0}/packages.json'.format(m))
-                # if fetch was successful break from loop
-                # the assumption is made that mirrors are up-to-date
-                break
-            except urllib.error.URLError as e:
-                errors.append('pake: fail: {0}: while getting packages from {1}'.format(e, m))
-                packages = []
-            finally:
-                pass
+    packages = []
+    for m in mirrors:
+        print('\t', m)
+        try:
+            packages = shared.fetchjson('{0}/packages.json'.format(m))
+            # if fetch was successful break from loop
+            # the assumption is made that mirrors are up-to-date
+            break
+        except urllib.error.URLError as e:
+            errors.append('pake: fail: {0}: while getting packages from {1}'.format(e, m))
+    return packages
+
 
+def iterpackages(root, errors=None, fields=('meta', 'dependencies', 'versions')):
+    """This function will generate packages that can be found in the network.
+    Packages are yielded one by one (as `pake.records.IndexedPackage` objects) so
+    the index does not have to be held in memory.
+
+    :param errors: list to which error messages are appended
+    :param fields: which JSON files of each package to fetch
+    """
+    if errors is None: errors = []
+    for alien in config.node.Aliens(root).iteraliens():
+        mirrors = alien.mirrors
+        packages = _fetchpackages(mirrors, errors)
         for m in mirrors:
-            indexpart = []
             for name in packages:
                 pack = {}
-                for i in ['meta', 'dependencies', 'versions']:
-                    print('trying package: {0}'.format(name))
+                print('trying package: {0}'.format(name))
+                for i in fields:
                     print('\tfrom mirror: {0}'.format(m))
                     resource = '{0}/packages/{1}/{2}.json'.format(m, name, i)
                     try:
                         pack[i] = shared.fetchjson(resource)
-                        indexpart.append(pack)
                     except (urllib.error.HTTPError, urllib.error.URLError) as e:
                         errors.append('{0}: {1}'.format(e, resource))
-                    finally:
-                        pass
-            index.extend(indexpart)
+                if pack: yield records.IndexedPackage(name, alien.url, **pack)
+
+
+def getindex(root):
+    """This function will generate and return index of packages that can be found
+    in the network.
+
+    :returns: two-tuple (pkg-index, list-of-errors)
+    """
+    errors = []
+    index = [pack.asdict() for pack in iterpackages(root, errors)]
     return (index, errors)
 
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""Lightweight records for aliens, pushers, nests and indexed packages.
+
+Records use `__slots__` so they are much smaller than dictionaries when
+there are hundreds of thousands of them, and intern strings that repeat
+across records (URLs of origins, package names).
+
+Nested JSON (metadata, mirror lists, version lists) is stored as given.
+If it's given as `Encoded` JSON string it's decoded on first access
+(other strings are never decoded).
+"""
+
+
+import json
+import sys
+
+
+def _intern(s):
+    return (sys.intern(s) if type(s) is str else s)
+
+
+class Encoded(str):
+    """JSON-encoded value of a field, decoded on first access.
+    """
+    __slots__ = ()
+
+
+def _decode(value):
+    return (json.loads(value) if type(value) is Encoded else value)
+
+
+class Alien():
+    """Alien node.
+    """
+    __slots__ = ('url', '_mirrors', '_meta')
+
+    def __init__(self, url, mirrors, meta):
+        self.url = _intern(url)
+        self._mirrors = mirrors
+        self._meta = meta
+
+    def __repr__(self):
+        return 'Alien({0!r})'.format(self.url)
+
+    @property
+    def mirrors(self):
+        self._mirrors = _decode(self._mirrors)
+        return self._mirrors
+
+    @property
+    def meta(self):
+        self._meta = _decode(self._meta)
+        return self._meta
+
+    def asdict(self):
+        """Returns alien dictionary (as returned by `pake.config.node.Aliens.all()`).
+        """
+        return {'url': self.url, 'mirrors': self.mirrors, 'meta': self.meta}
+
+
+class Pusher():
+    """Pusher (mirror of the local node).
+    """
+    __slots__ = ('url', 'host', 'cwd')
+
+    def __init__(self, url, host, cwd=''):
+        self.url = url
+        self.host = _intern(host)
+        self.cwd = cwd
+
+    def __repr__(self):
+        return 'Pusher({0!r})'.format(self.url)
+
+    def asdict(self):
+        """Returns pusher dictionary (as stored in pushers.json).
+        """
+        return {'url': self.url, 'host': self.host, 'cwd': self.cwd}
+
+
+class NestRef():
+    """Reference to a nest registered in the node.
+    Metadata of the nest is read on first access.
+    """
+    __slots__ = ('name', 'path', '_meta')
+
+    def __init__(self, name, path):
+        self.name = _intern(name)
+        self.path = path
+        self._meta = None
+
+    def __repr__(self):
+        return 'NestRef({0!r}, {1!r})'.format(self.name, self.path)
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            from . import config
+            self._meta = config.nest.Meta(self.path)
+        return self._meta
+
+    def asdict(self):
+        return {'name': self.name, 'path': self.path}
+
+
+class IndexedPackage():
+    """Package found in the network.
+    Fields that were not fetched are None.
+    """
+    __slots__ = ('name', 'origin', '_versions', '_meta', '_dependencies')
+
+    def __init__(self, name, origin, versions=None, meta=None, dependencies=None):
+        self.name = _intern(name)
+        self.origin = _intern(origin)
+        self._versions = versions
+        self._meta = meta
+        self._dependencies = dependencies
+
+    def __repr__(self):
+        return 'IndexedPackage({0!r}, {1!r})'.format(self.name, self.origin)
+
+    @property
+    def versions(self):
+        self._versions = _decode(self._versions)
+        return self._versions
+
+    @property
+    def meta(self):
+        self._meta = _decode(self._meta)
+        return self._meta
+
+    @property
+    def dependencies(self):
+        self._dependencies = _decode(self._dependencies)
+        return self._dependencies
+
+    def asdict(self):
+        """Returns package dictionary (as stored in packages index) with
+        fields that were fetched.
+        """
+        pack = {'name': self.name, 'origin': self.origin}
+        for key in ['meta', 'dependencies', 'versions']:
+            value = getattr(self, key)
+            if value is not None: pack[key] = value
+        return pack
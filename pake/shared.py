@@ -16,6 +16,7 @@ API clarifications:
 """
 
 
+import hashlib
 import json
 import os
 import urllib.request
@@ -103,6 +104,19 @@ def fetchjson(url):
     return fetched
 
 
+def filedigest(path, algorithm='sha256'):
+    """Returns hex digest of a file.
+
+    :param path: path to the file
+    :param algorithm: name of the hashing algorithm (as accepted by hashlib)
+    """
+    digest = hashlib.new(algorithm)
+    ifstream = open(path, 'rb')
+    for chunk in iter(lambda: ifstream.read(1024 * 1024), b''): digest.update(chunk)
+    ifstream.close()
+    return digest.hexdigest()
+
+
 def checkinput(options):
     """Checks user input for errors.
     """
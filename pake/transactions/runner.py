@@ -46,16 +46,21 @@ class Runner():
             pake.node.manager.makeconfig(req['path'])
         elif action == 'node.manager.reinit':
             confpath = os.path.join(req['path'], '.pakenode')
-            meta = pake.config.node.Meta(confpath)
-            nests = pake.config.node.Nests(confpath)
-            pushers = pake.config.node.Pushers(confpath)
-            aliens = pake.config.node.Aliens(confpath)
+            database = pake.config.sqlite.backup(confpath)
+            # configs are read lazily so they must be read before the node is removed
+            meta = pake.config.node.Meta(confpath).read()
+            nests = pake.config.node.Nests(confpath).read()
+            pushers = pake.config.node.Pushers(confpath).read()
+            aliens = pake.config.node.Aliens(confpath).read()
             self._executenode('node.manager.remove', {'path': req['path']})
             self._executenode('node.manager.init', {'path': req['path']})
-            meta.write()
-            nests.write()
-            pushers.write()
-            aliens.write()
+            if database is None:
+                meta.write(force=True)
+                nests.write(force=True)
+                pushers.write(force=True)
+                aliens.write(force=True)
+            else:
+                pake.config.sqlite.restore(confpath, database)
         elif action == 'node.manager.remove':
             pake.node.manager.remove(req['path'])
         elif action == 'node.config.meta.set':
@@ -144,7 +149,7 @@ class Runner():
             depconf = pake.config.nest.Dependencies(os.path.join(root, '.pakenest'))
             deps = []
             for i in list(depconf):
-                dep = depconf.get(i)
+                dep = dict(depconf.get(i))
                 dep['name'] = i
                 deps.append(dep)
             self._stack.append(deps)
@@ -4,8 +4,12 @@
 """
 
 
+import ftplib
 import os
+import posixpath
 import shutil
+import threading
+import time
 
 
 import pake
@@ -83,3 +87,214 @@ def buildTestPackage(path, version='0.2.4.8', files=['./pake/__init__.py', './pa
     for i in directories: pake.nest.package.adddir(path, **i)
     pake.nest.package.build(root=path, version=version)
     return version
+
+
+def genpushable(path, url, host='ftp.example.com', cwd='mirror', version='2.4.8.16'):
+    """Generates a node with one registered package in the test directory, ready to be pushed.
+    Returns version of the package.
+
+    :param path: test directory
+    :param url: URL of the mirror
+    """
+    gennode(path)
+    gennest(path)
+    buildTestPackage(os.path.join(path, '.pakenest'), version=version)
+    root = os.path.join(path, '.pakenode')
+    pake.config.node.Pushers(root).set(url=url, host=host, cwd=cwd).write()
+    pake.node.packages.register(root=root, path=os.path.abspath(path))
+    pake.node.packages.genpkglist(root=root)
+    pake.node.pusher.genmirrorlist(root)
+    return version
+
+
+class FakeFTPServer():
+    """In-memory FTP server used to test pushing.
+    Sessions are created with connect() (which can replace `pake.node.pusher.FTPPusher`),
+    and every command they issue is recorded in `commands` as a string.
+
+    Connections can be dropped during uploads: `drops` maps remote paths (or their prefixes)
+    to lists of numbers of bytes received before the connection is dropped, one for every upload.
+    Uploads to paths (or prefixes) in `refused` fail with permanent error.
+    """
+    def __init__(self, mlsd=True, rest=True):
+        """
+        :param mlsd: whether MLSD command is supported (if not, NLST is used)
+        :param rest: whether REST is supported for uploads (if not, APPE is used)
+        """
+        self.mlsd = mlsd
+        self.rest = rest
+        self.files = {}
+        self.mtimes = {}
+        self.dirs = set(['/'])
+        self.commands = []
+        self.sessions = []
+        self.drops = {}
+        self.refused = set()
+        self.lock = threading.Lock()
+
+    def connect(self, host=''):
+        session = FakeFTP(self, host)
+        with self.lock: self.sessions.append(session)
+        return session
+
+    def makedirs(self, path):
+        while path not in self.dirs:
+            self.dirs.add(path)
+            path = posixpath.dirname(path)
+        return self
+
+    def put(self, path, data, mtime=None):
+        """Stores file on the server (creating its directory).
+        """
+        self.makedirs(posixpath.dirname(path))
+        self.files[path] = data
+        self.mtimes[path] = (time.time() if mtime is None else mtime)
+        return self
+
+    def count(self, command):
+        """Returns number of recorded commands equal to given one.
+        """
+        with self.lock: return self.commands.count(command)
+
+
+class FakeFTP(pake.node.pusher.FTPPusher):
+    """Session with FakeFTPServer.
+    """
+    def __init__(self, server, host=''):
+        # no connection is made
+        self.server = server
+        self.host = host
+        self.directory = '/'
+        self.quitted = False
+        self.closed = False
+
+    def _record(self, command):
+        if self.closed: raise ConnectionResetError('session is closed')
+        with self.server.lock: self.server.commands.append(command)
+
+    def _path(self, path):
+        return posixpath.normpath(posixpath.join(self.directory, path))
+
+    def _split(self, command):
+        verb, path = command.split(' ', 1)
+        return (verb, self._path(path))
+
+    def login(self, user='', passwd='', acct=''):
+        self._record('USER {0}'.format(user))
+        return '230 logged in'
+
+    def cwd(self, dirname):
+        self._record('CWD {0}'.format(dirname))
+        path = self._path(dirname)
+        if path not in self.server.dirs: raise ftplib.error_perm('550 no such directory: {0}'.format(path))
+        self.directory = path
+        return '250 OK'
+
+    def pwd(self):
+        self._record('PWD')
+        return self.directory
+
+    def voidcmd(self, cmd):
+        self._record(cmd)
+        return '200 OK'
+
+    def _modify(self, path):
+        return time.strftime('%Y%m%d%H%M%S', time.gmtime(self.server.mtimes[path]))
+
+    def sendcmd(self, cmd):
+        self._record(cmd)
+        verb, path = self._split(cmd)
+        if verb != 'MDTM' or path not in self.server.files: raise ftplib.error_perm('550 {0}'.format(cmd))
+        return '213 {0}'.format(self._modify(path))
+
+    def size(self, filename):
+        self._record('SIZE {0}'.format(filename))
+        path = self._path(filename)
+        if path not in self.server.files: raise ftplib.error_perm('550 no such file: {0}'.format(path))
+        return len(self.server.files[path])
+
+    def storbinary(self, cmd, fp, blocksize=8192, callback=None, rest=None):
+        if rest is not None:
+            self._record('REST {0}'.format(rest))
+            if not self.server.rest: raise ftplib.error_perm('502 REST not implemented for STOR')
+        self._record(cmd)
+        verb, path = self._split(cmd)
+        if posixpath.dirname(path) not in self.server.dirs:
+            raise ftplib.error_perm('553 no such directory: {0}'.format(path))
+        with self.server.lock:
+            if [prefix for prefix in self.server.refused if path.startswith(prefix)]:
+                raise ftplib.error_perm('553 refused: {0}'.format(path))
+            drops = [limits for prefix, limits in self.server.drops.items() if path.startswith(prefix) and limits]
+            limit = (drops[0].pop(0) if drops else None)
+            data = fp.read()
+            if limit is not None: data = data[:limit]
+            if verb == 'APPE': data = self.server.files.get(path, b'') + data
+            elif rest: data = self.server.files.get(path, b'')[:rest] + data
+            self.server.files[path] = data
+            self.server.mtimes[path] = time.time()
+        if limit is not None:
+            self.closed = True
+            raise ConnectionResetError('connection dropped after {0} bytes'.format(limit))
+        return '226 transfer complete'
+
+    def retrbinary(self, cmd, callback, blocksize=8192, rest=None):
+        self._record(cmd)
+        verb, path = self._split(cmd)
+        if path not in self.server.files: raise ftplib.error_perm('550 no such file: {0}'.format(path))
+        callback(self.server.files[path])
+        return '226 transfer complete'
+
+    def delete(self, filename):
+        self._record('DELE {0}'.format(filename))
+        path = self._path(filename)
+        with self.server.lock:
+            if path not in self.server.files: raise ftplib.error_perm('550 no such file: {0}'.format(path))
+            del self.server.files[path]
+        return '250 deleted'
+
+    def rename(self, fromname, toname):
+        self._record('RNFR {0}'.format(fromname))
+        self._record('RNTO {0}'.format(toname))
+        source, target = self._path(fromname), self._path(toname)
+        with self.server.lock:
+            if source not in self.server.files: raise ftplib.error_perm('550 no such file: {0}'.format(source))
+            self.server.files[target] = self.server.files.pop(source)
+            self.server.mtimes[target] = self.server.mtimes.pop(source)
+        return '250 renamed'
+
+    def mkd(self, dirname):
+        self._record('MKD {0}'.format(dirname))
+        path = self._path(dirname)
+        with self.server.lock:
+            if path in self.server.dirs: raise ftplib.error_perm('550 directory exists: {0}'.format(path))
+            self.server.dirs.add(path)
+        return path
+
+    def _entries(self, path):
+        if path not in self.server.dirs: raise ftplib.error_perm('550 no such directory: {0}'.format(path))
+        with self.server.lock:
+            dirs = [(posixpath.basename(i), {'type': 'dir'})
+                    for i in self.server.dirs if i != path and posixpath.dirname(i) == path]
+            files = [(posixpath.basename(i), {'type': 'file', 'size': str(len(data)), 'modify': self._modify(i)})
+                     for i, data in self.server.files.items() if posixpath.dirname(i) == path]
+        return sorted(dirs + files)
+
+    def mlsd(self, path='', facts=[]):
+        self._record('MLSD {0}'.format(path))
+        if not self.server.mlsd: raise ftplib.error_perm('500 unknown command MLSD')
+        return iter(self._entries(self._path(path)))
+
+    def nlst(self, *args):
+        path = (args[0] if args else '')
+        self._record('NLST {0}'.format(path))
+        # like many servers, full paths are returned
+        return [posixpath.join(path, name) for name, facts in self._entries(self._path(path))]
+
+    def quit(self):
+        self._record('QUIT')
+        self.quitted = True
+        self.close()
+        return '221 bye'
+
+    def close(self):
+        self.closed = True
@@ -4,11 +4,17 @@
 """
 
 
+import fcntl
+import hashlib
+import io
 import json
+import lzma
 import os
 import shutil
 import tarfile
+import threading
 import unittest
+import unittest.mock
 import warnings
 
 
@@ -111,6 +117,107 @@ class NodeConfigurationTests(unittest.TestCase):
         # cleanup
         helpers.rmnode(testdir)
 
+    def testReadCacheIsReusedWhileFileIsNotChanged(self):
+        helpers.gennode(testdir)
+        # test logic
+        pake.config.node.Meta(test_node_root).set('foo', 'bar').write()
+        pake.config.base.clearcache()
+        pake.config.node.Meta(test_node_root).keys()
+        pake.config.node.Meta(test_node_root).keys()
+        self.assertEqual({'hits': 1, 'misses': 1}, pake.config.base.cachestats())
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testModifyingCachedContentDoesNotLeakToOtherObjects(self):
+        helpers.gennode(testdir)
+        # test logic
+        pake.config.node.Meta(test_node_root).set('foo', 'bar').write()
+        pake.config.node.Meta(test_node_root)
+        pake.config.node.Meta(test_node_root).set('foo', 'baz')
+        self.assertEqual('bar', pake.config.node.Meta(test_node_root).get('foo'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testWritingUnmodifiedConfigIsNoop(self):
+        helpers.gennode(testdir)
+        # test logic
+        path = os.path.join(test_node_root, 'meta.json')
+        pake.config.node.Meta(test_node_root).set('foo', 'bar').write()
+        before = os.stat(path)
+        meta = pake.config.node.Meta(test_node_root)
+        self.assertEqual(False, meta.modified())
+        meta.write()
+        after = os.stat(path)
+        self.assertEqual((before.st_ino, before.st_mtime_ns), (after.st_ino, after.st_mtime_ns))
+        self.assertEqual(True, meta.set('foo', 'baz').modified())
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testWritingUnmodifiedConfigKeepsOtherWriters(self):
+        helpers.gennode(testdir)
+        # test logic
+        first = pake.config.node.Meta(test_node_root)
+        self.assertRaises(KeyError, first.get, 'b')
+        pake.config.node.Meta(test_node_root).set('b', 'B').write()
+        first.write()
+        self.assertEqual('B', pake.config.node.Meta(test_node_root).get('b'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testWritingLeavesNoTemporaryFiles(self):
+        helpers.gennode(testdir)
+        # test logic
+        pake.config.node.Meta(test_node_root).set('foo', 'bar').write(fsync=False)
+        self.assertEqual([], [i for i in os.listdir(test_node_root) if i.endswith('.tmp')])
+        self.assertEqual('bar', pake.config.node.Meta(test_node_root).get('foo'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testConfigIsNotReadBeforeContentIsAccessed(self):
+        helpers.gennode(testdir)
+        # test logic
+        pake.config.node.Meta(test_node_root).set('foo', 'bar').write()
+        pake.config.base.clearcache()
+        pake.config.node.Meta(test_node_root).reset().set('foo', 'baz').write()
+        self.assertEqual({'hits': 0, 'misses': 0}, pake.config.base.cachestats())
+        self.assertEqual('baz', pake.config.node.Meta(test_node_root).get('foo'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testJournaledConfigAppendsChangesToJournal(self):
+        helpers.gennode(testdir)
+        # test logic
+        path = os.path.join(test_node_root, 'aliens.json')
+        aliens = pake.config.node.Aliens(test_node_root)
+        aliens.journaled = True
+        aliens.set('http://alien.example.com', [], {}).write()
+        aliens.set('http://alien.example.org', [], {}).remove('http://alien.example.com').write()
+        ifstream = open(path)
+        self.assertEqual({}, json.loads(ifstream.read()))
+        ifstream.close()
+        self.assertEqual(True, os.path.isfile(path + '.journal'))
+        pake.config.base.clearcache()
+        self.assertEqual(['http://alien.example.org'], pake.config.node.Aliens(test_node_root).urls())
+        pake.config.node.Aliens(test_node_root).compact()
+        self.assertEqual(False, os.path.isfile(path + '.journal'))
+        ifstream = open(path)
+        self.assertEqual({'http://alien.example.org': {'mirrors': [], 'meta': {}}}, json.loads(ifstream.read()))
+        ifstream.close()
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testJournalIsCompactedWhenItGrowsOverThreshold(self):
+        helpers.gennode(testdir)
+        # test logic
+        path = os.path.join(test_node_root, 'meta.json')
+        meta = pake.config.node.Meta(test_node_root)
+        meta.journaled, meta.journalthreshold = True, 64
+        for i in range(8): meta.set('foo', 'bar' * i).write()
+        self.assertEqual(False, os.path.isfile(path + '.journal'))
+        self.assertEqual('bar' * 7, pake.config.node.Meta(test_node_root).get('foo'))
+        # cleanup
+        helpers.rmnode(testdir)
+
     def testSettingPusher(self):
         helpers.gennode(testdir)
         # test logic
@@ -148,6 +255,47 @@ class NodeConfigurationTests(unittest.TestCase):
         # cleanup
         helpers.rmnode(testdir)
 
+    def testSettingPusherWithExistingURLOverwritesIt(self):
+        helpers.gennode(testdir)
+        # test logic
+        pake.config.node.Pushers(test_node_root).set(url='http://pake.example.com', host='example.com').write()
+        pake.config.node.Pushers(test_node_root).set(url='http://pake.example.com', host='example.org').write()
+        pushers = pake.config.node.Pushers(test_node_root)
+        self.assertEqual(['http://pake.example.com'], pushers.geturls())
+        self.assertEqual('example.org', pushers.get('http://pake.example.com')['host'])
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testGettingPushersAfterRemovingOne(self):
+        helpers.gennode(testdir)
+        # test logic
+        pushers = pake.config.node.Pushers(test_node_root)
+        urls = ['http://pake{0}.example.com'.format(i) for i in range(8)]
+        for url in urls: pushers.set(url=url, host='example.com')
+        pushers.remove(urls[3]).remove(urls[0])
+        for url in urls[1:3] + urls[4:]: self.assertEqual(url, pushers.get(url)['url'])
+        self.assertEqual(None, pushers.get(urls[3]))
+        self.assertEqual(False, pushers.hasurl(urls[0]))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testRemovingDuplicatedPusherKeepsTheOtherOne(self):
+        helpers.gennode(testdir)
+        # older versions could store many pushers with the same URL
+        duplicated = [{'url': 'http://pake.example.com', 'host': host, 'cwd': ''}
+                      for host in ['example.com', 'example.org']]
+        ofstream = open(os.path.join(test_node_root, 'pushers.json'), 'w')
+        ofstream.write(json.dumps(duplicated))
+        ofstream.close()
+        # test logic
+        pushers = pake.config.node.Pushers(test_node_root).remove('http://pake.example.com')
+        self.assertEqual(True, pushers.hasurl('http://pake.example.com'))
+        self.assertEqual('example.org', pushers.get('http://pake.example.com')['host'])
+        pushers.set(url='http://pake.example.com', host='example.net')
+        self.assertEqual(['http://pake.example.com'], pushers.geturls())
+        # cleanup
+        helpers.rmnode(testdir)
+
     def testAddingAlien(self):
         helpers.gennode(testdir)
         # test logic
@@ -158,6 +306,41 @@ class NodeConfigurationTests(unittest.TestCase):
         # cleanup
         helpers.rmnode(testdir)
 
+    def testResolvingAlienMirrors(self):
+        helpers.gennode(testdir)
+        # test logic
+        alien = {'url': 'http://alien.example.com', 'meta': {},
+                 'mirrors': ['http://alien.example.com', 'http://mirror.example.com']}
+        pake.config.node.Aliens(test_node_root).set(**alien).write()
+        aliens = pake.config.node.Aliens(test_node_root)
+        self.assertIn('http://mirror.example.com', aliens)
+        self.assertEqual('http://alien.example.com', aliens.resolve('http://mirror.example.com'))
+        self.assertEqual(None, aliens.resolve('http://alien.example.org'))
+        aliens.set(url='http://alien.example.com', mirrors=['http://alien.example.com'], meta={})
+        self.assertNotIn('http://mirror.example.com', aliens)
+        aliens.remove('http://alien.example.com')
+        self.assertNotIn('http://alien.example.com', aliens)
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testResolvingMirrorSharedByAliens(self):
+        helpers.gennode(testdir)
+        # test logic
+        foo, bar, mirror = 'http://foo.example.com', 'http://bar.example.com', 'http://mirror.example.com'
+        aliens = pake.config.node.Aliens(test_node_root).set(foo, [foo, mirror], {}).set(bar, [bar, mirror], {})
+        self.assertEqual(foo, aliens.resolve(mirror))
+        aliens.set(foo, [foo], {})
+        self.assertEqual(bar, aliens.resolve(mirror))
+        aliens.set(foo, [foo, mirror], {})
+        self.assertEqual(foo, aliens.resolve(mirror))
+        aliens.remove(foo)
+        self.assertEqual(bar, aliens.resolve(mirror))
+        self.assertEqual(None, aliens.resolve(foo))
+        aliens.remove(bar)
+        self.assertEqual(None, aliens.resolve(mirror))
+        # cleanup
+        helpers.rmnode(testdir)
+
     def testRemovingAlien(self):
         helpers.gennode(testdir)
         # test logic
@@ -251,6 +434,174 @@ class NodeConfigurationTests(unittest.TestCase):
         # cleanup
         helpers.rmnode(testdir)
 
+    def testIteratingOverConfigsYieldsRecords(self):
+        helpers.gennode(testdir)
+        # test logic
+        alien = {'mirrors': ['http://mirror.example.com'], 'meta': {'url': 'http://alien.example.com'}}
+        pake.config.node.Aliens(test_node_root).set('http://alien.example.com', **alien).write()
+        pake.config.node.Pushers(test_node_root).set(url='http://pake.example.com', host='example.com').write()
+        pake.config.node.Nests(test_node_root).set('foo', '~/Dev/foo').write()
+        aliens = list(pake.config.node.Aliens(test_node_root).iteraliens())
+        self.assertEqual([dict(url='http://alien.example.com', **alien)], [a.asdict() for a in aliens])
+        self.assertRaises(AttributeError, setattr, aliens[0], 'foo', 'bar')
+        pushers = list(pake.config.node.Pushers(test_node_root).iterpushers())
+        self.assertEqual([('http://pake.example.com', 'example.com', '')], [(p.url, p.host, p.cwd) for p in pushers])
+        nests = list(pake.config.node.Nests(test_node_root).iternests())
+        self.assertEqual([('foo', '~/Dev/foo')], [(n.name, n.path) for n in nests])
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testRecordsDecodeOnlyEncodedFields(self):
+        mirrors = pake.records.Encoded('["http://mirror.example.com"]')
+        alien = pake.records.Alien('http://alien.example.com', mirrors, '1.0')
+        for i in range(2):
+            self.assertEqual(['http://mirror.example.com'], alien.mirrors)
+            self.assertEqual('1.0', alien.meta)
+        package = pake.records.IndexedPackage('foo', 'http://foo.example.com', versions=pake.records.Encoded('"null"'))
+        for i in range(2): self.assertEqual('null', package.versions)
+
+
+class NodeSessionTests(unittest.TestCase):
+    def testSessionWritesModifiedConfigsOnExit(self):
+        helpers.gennode(testdir)
+        # test logic
+        with pake.config.session.NodeSession(test_node_root) as session:
+            for name in ['foo', 'bar', 'baz']: session.nests.set(name, '~/Dev/{0}'.format(name))
+            session.meta.set('url', 'http://pake.example.com')
+            self.assertEqual({}, dict(pake.config.node.Nests(test_node_root)))
+        self.assertEqual(['bar', 'baz', 'foo'], sorted(pake.config.node.Nests(test_node_root).names()))
+        self.assertEqual('http://pake.example.com', pake.config.node.Meta(test_node_root).get('url'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testLockedSessionHoldsLocksUntilClosed(self):
+        helpers.gennode(testdir)
+        # test logic
+        lockpath = os.path.join(test_node_root, '.nests.json.lock')
+        with pake.config.session.NodeSession(test_node_root, lock=True) as session:
+            session.nests.set('foo', '~/Dev/foo')
+            fd = os.open(lockpath, os.O_RDWR)
+            self.assertRaises(BlockingIOError, fcntl.flock, fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        os.close(fd)
+        self.assertEqual('~/Dev/foo', pake.config.node.Nests(test_node_root).get('foo'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testLockingSameFileThroughDifferentPathsSharesLock(self):
+        helpers.gennode(testdir)
+        # test logic
+        relative = os.path.join(test_node_root, 'nests.json')
+        absolute = os.path.abspath(relative)
+        with pake.config.base.locked(relative) as first: pass
+        with pake.config.base.locked(absolute) as second: pass
+        self.assertIs(first, second)
+        with pake.config.base.locked(relative):
+            with pake.config.base.locked(absolute, exclusive=False) as lock:
+                self.assertEqual(2, lock._depth)
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testSessionDiscardsChangesOnError(self):
+        helpers.gennode(testdir)
+        # test logic
+        try:
+            with pake.config.session.NodeSession(test_node_root) as session:
+                session.nests.set('foo', '~/Dev/foo')
+                raise KeyError('foo')
+        except KeyError:
+            pass
+        self.assertEqual({}, dict(pake.config.node.Nests(test_node_root)))
+        # cleanup
+        helpers.rmnode(testdir)
+
+
+class NodeSQLiteStorageTests(unittest.TestCase):
+    def testMigratingNodeToSQLite(self):
+        helpers.gennode(testdir)
+        # test logic
+        pake.config.node.Meta(test_node_root).set('url', 'http://pake.example.com').write()
+        pake.config.node.Nests(test_node_root).set('foo', '~/Dev/foo').write()
+        aliens = pake.config.node.Aliens(test_node_root)
+        aliens.set('http://alien.example.com', ['http://mirror.example.com'], {}).write()
+        pake.config.sqlite.migrate(test_node_root)
+        self.assertEqual(pake.config.sqlite.Meta, type(pake.config.node.Meta(test_node_root)))
+        self.assertEqual('http://pake.example.com', pake.config.node.Meta(test_node_root).get('url'))
+        self.assertEqual('~/Dev/foo', pake.config.node.Nests(test_node_root).get('foo'))
+        resolved = pake.config.node.Aliens(test_node_root).resolve('http://mirror.example.com')
+        self.assertEqual('http://alien.example.com', resolved)
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testSQLiteStorageFluentAPI(self):
+        helpers.gennode(testdir)
+        pake.config.sqlite.migrate(test_node_root)
+        # test logic
+        pusher = {'url': 'http://pake.example.com', 'host': 'example.com', 'cwd': ''}
+        pushers = pake.config.node.Pushers(test_node_root)
+        pushers.set(**pusher).set(url='http://pake.example.org', host='example.org').write()
+        pake.config.node.Pushers(test_node_root).remove('http://pake.example.org').write()
+        self.assertEqual([pusher], list(pake.config.node.Pushers(test_node_root)))
+        pake.config.node.Nests(test_node_root).set('foo', '~/Dev/foo').set('bar', '~/Dev/bar').remove('foo').write()
+        self.assertEqual(['bar'], pake.config.node.Nests(test_node_root).names())
+        self.assertRaises(KeyError, pake.config.node.Nests(test_node_root).get, 'foo')
+        pake.config.node.Meta(test_node_root).set('foo', 'bar')
+        self.assertEqual([], list(pake.config.node.Meta(test_node_root).keys()))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testExportingSQLiteStorageToJSON(self):
+        helpers.gennode(testdir)
+        pake.config.sqlite.migrate(test_node_root)
+        # test logic
+        alien = {'mirrors': ['http://alien.example.com'], 'meta': {'url': 'http://alien.example.com'}}
+        pake.config.node.Aliens(test_node_root).set(url='http://alien.example.com', **alien).write()
+        pake.config.sqlite.export(test_node_root)
+        ifstream = open(os.path.join(test_node_root, 'aliens.json'))
+        self.assertEqual({'http://alien.example.com': alien}, json.loads(ifstream.read()))
+        ifstream.close()
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testWritingSQLiteStorageHonoursFsync(self):
+        helpers.gennode(testdir)
+        pake.config.sqlite.migrate(test_node_root)
+        # test logic
+        meta = pake.config.node.Meta(test_node_root)
+        meta.set('foo', 'bar').write(fsync=False)
+        self.assertEqual((1,), meta._getdb().execute('PRAGMA synchronous').fetchone())
+        meta.set('foo', 'baz').write()
+        self.assertEqual((2,), meta._getdb().execute('PRAGMA synchronous').fetchone())
+        self.assertEqual('baz', pake.config.node.Meta(test_node_root).get('foo'))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testFailedMigrationKeepsOriginalError(self):
+        helpers.gennode(testdir)
+        # test logic
+        error = pake.config.sqlite.sqlite3.OperationalError('database is locked')
+        with unittest.mock.patch.object(pake.config.sqlite, 'connect', side_effect=error):
+            self.assertRaises(pake.config.sqlite.sqlite3.OperationalError, pake.config.sqlite.migrate, test_node_root)
+        self.assertEqual(False, pake.config.sqlite.enabled(test_node_root))
+        self.assertRaises(TypeError, pake.config.sqlite._Store, test_node_root)
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testIteratingOverSQLiteAliens(self):
+        helpers.gennode(testdir)
+        pake.config.sqlite.migrate(test_node_root)
+        # test logic
+        foo = {'mirrors': ['http://foo.example.com'], 'meta': {'url': 'http://foo.example.com'}}
+        bar = {'mirrors': ['http://bar.example.com'], 'meta': {'url': 'http://bar.example.com'}}
+        pake.config.node.Aliens(test_node_root).set(url='http://foo.example.com', **foo).write()
+        aliens = pake.config.node.Aliens(test_node_root).set(url='http://bar.example.com', **bar)
+        records = list(aliens.iteraliens())
+        self.assertEqual(['http://foo.example.com', 'http://bar.example.com'], [a.url for a in records])
+        self.assertEqual(foo['mirrors'], records[0].mirrors)
+        self.assertEqual(bar['meta'], records[1].meta)
+        # cleanup
+        helpers.rmnode(testdir)
+
 
 class NodePackagesTests(unittest.TestCase):
     def testRegisteringNests(self):
@@ -285,6 +636,29 @@ class NodePackagesTests(unittest.TestCase):
         helpers.rmnode(testdir)
         helpers.rmnest(testdir)
 
+    def testBatchBuildingRegisteredNests(self):
+        helpers.gennode(testdir)
+        helpers.gennest(testdir)
+        other = os.path.join(testdir, 'other')
+        os.mkdir(other)
+        helpers.gennest(other)
+        # test logic
+        pake.config.nest.Meta(test_nest_root).set('name', 'foo').set('version', '0.1.0').write()
+        pake.config.nest.Files(test_nest_root).add(os.path.abspath('./pake/__init__.py')).write()
+        # nest without version must fail without stopping other builds
+        pake.config.nest.Meta(os.path.join(other, '.pakenest')).set('name', 'bar').write()
+        pake.node.packages.register(root=test_node_root, path=testdir)
+        pake.node.packages.register(root=test_node_root, path=other)
+        results = pake.node.builder.build(test_node_root, jobs=2)
+        self.assertEqual(['bar', 'foo'], [r.name for r in results])
+        self.assertEqual([False, True], [r.ok for r in results])
+        self.assertIn('build.tar.xz', os.listdir(os.path.join(test_nest_root, 'versions', '0.1.0')))
+        self.assertEqual(['baz'], [r.name for r in pake.node.builder.build(test_node_root, names=['baz']) if not r.ok])
+        # cleanup
+        shutil.rmtree(other)
+        helpers.rmnode(testdir)
+        helpers.rmnest(testdir)
+
 
 class NodePushingTests(unittest.TestCase):
     def testMirrorlistGeneration(self):
@@ -298,6 +672,335 @@ class NodePushingTests(unittest.TestCase):
         # cleanup
         helpers.rmnode(testdir)
 
+    def testPushingToManyMirrorsReportsEveryMirror(self):
+        helpers.gennode(testdir)
+        # nothing listens on FTP port of localhost so connections are refused
+        pake.config.node.Pushers(test_node_root).set(url='http://pake.example.com', host='127.0.0.1', cwd='').write()
+        pake.node.pusher.genmirrorlist(test_node_root)
+        messages = []
+        # test logic
+        credentials = [('http://pake.example.com', 'user', 'pass'), ('http://pake.example.org', 'user', 'pass')]
+        results = pake.node.pusher.pushall(test_node_root, credentials, jobs=2,
+                                           progress=lambda url, message: messages.append((url, message)))
+        self.assertEqual([url for url, username, password in credentials], [r.url for r in results])
+        self.assertEqual([False, False], [r.ok for r in results])
+        self.assertIsInstance(results[0].exception, OSError)
+        self.assertIn('no pusher found', results[1].error)
+        self.assertEqual(set(['http://pake.example.com', 'http://pake.example.org']),
+                         set([url for url, message in messages]))
+        self.assertEqual([], pake.node.pusher.pushall(test_node_root, {}))
+        # cleanup
+        helpers.rmnode(testdir)
+
+    def testPoolReusesSessionsInLIFOOrder(self):
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=4)
+            first, second = pool.acquire(), pool.acquire()
+            self.assertEqual('/mirror', pool.root)
+            pool.release(first)
+            pool.release(second)
+            self.assertIs(second, pool.acquire())
+            self.assertIs(first, pool.acquire())
+            self.assertEqual(2, len(server.sessions))
+            pool.release(first)
+            pool.release(second)
+            pool.close()
+
+    def testPoolOpensAtMostSizeSessions(self):
+        server = helpers.FakeFTPServer()
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', size=2)
+            sessions = [pool.acquire(), pool.acquire()]
+            acquired = []
+            waiting = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+            waiting.start()
+            waiting.join(0.2)
+            self.assertEqual(True, waiting.is_alive())
+            pool.release(sessions[0])
+            waiting.join()
+            self.assertEqual([sessions[0]], acquired)
+            self.assertEqual(2, len(server.sessions))
+            pool.release(sessions[0])
+            pool.release(sessions[1])
+            pool.close()
+
+    def testPoolDoesNotReuseSessionThatFailed(self):
+        server = helpers.FakeFTPServer()
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', size=1)
+            with self.assertRaises(EOFError):
+                with pool.session() as broken: raise EOFError()
+            self.assertEqual(True, broken.closed)
+            with pool.session() as remote: self.assertIsNot(broken, remote)
+            self.assertEqual(2, len(server.sessions))
+            pool.close()
+
+    def testClosingPoolQuitsEverySession(self):
+        server = helpers.FakeFTPServer()
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', size=3)
+            sessions = [pool.acquire() for i in range(3)]
+            for remote in sessions: pool.release(remote)
+            pool.close()
+        self.assertEqual([True, True, True], [remote.quitted for remote in server.sessions])
+        self.assertEqual(3, server.count('QUIT'))
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            with pool.session() as remote: self.assertNotIn(remote, sessions)
+
+    def testPrefetchingListsEveryDirectoryOnce(self):
+        server = helpers.FakeFTPServer().makedirs('/mirror/packages/foo/versions/1.0').makedirs('/mirror/cache')
+        server.makedirs('/mirror/packages/bar/versions').put('/mirror/meta.json', b'{}')
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=2)
+            pool.listings.prefetch(depth=3)
+            listed = ['/mirror', '/mirror/cache', '/mirror/packages', '/mirror/packages/bar',
+                      '/mirror/packages/bar/versions', '/mirror/packages/foo', '/mirror/packages/foo/versions']
+            listings = sorted([c for c in server.commands if c.startswith('MLSD')])
+            self.assertEqual(['MLSD {0}'.format(path) for path in listed], listings)
+            self.assertEqual(True, pool.listings.has('/mirror/packages/foo/versions/1.0'))
+            self.assertEqual(True, pool.listings.has('/mirror/meta.json'))
+            self.assertEqual(len(listed), len([c for c in server.commands if c.startswith('MLSD')]))
+            pool.close()
+
+    def testCreatingDirectoryUpdatesListings(self):
+        server = helpers.FakeFTPServer(mlsd=False).makedirs('/mirror')
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            with pool.session() as remote:
+                self.assertEqual(False, pool.listings.has('/mirror/packages', remote))
+                pool.listings.mkd(remote, '/mirror/packages')
+                self.assertEqual(True, pool.listings.has('/mirror/packages', remote))
+                self.assertEqual(False, pool.listings.has('/mirror/packages/foo', remote))
+            self.assertEqual(['NLST /mirror'], [c for c in server.commands if c.startswith('NLST')])
+            self.assertIn('/mirror/packages', server.dirs)
+            pool.close()
+
+    def testMissingDirectoryIsListedAsEmpty(self):
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            self.assertEqual({}, pool.listings.get('/mirror/missing'))
+            self.assertEqual(False, pool.listings.has('/mirror/missing/foo'))
+            self.assertEqual(1, server.count('MLSD /mirror/missing'))
+            pool.close()
+
+    def testSelectingSkipsFilesUnchangedSincePush(self):
+        helpers.gennode(testdir)
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        path = os.path.join(testdir, 'foo.txt')
+        ofstream = open(path, 'w')
+        ofstream.write('foo')
+        ofstream.close()
+        state = {'size': 3, 'sha256': pake.shared.filedigest(path)}
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            with pool.session() as remote:
+                candidates = [(path, pool.path('foo.txt'), None)]
+                pool.manifest.set(pool.path('foo.txt'), state)
+                self.assertEqual([], pake.node.pusher._select(pool, remote, candidates))
+                pool.manifest.set(pool.path('foo.txt'), {'size': 3, 'sha256': '0' * 64})
+                uploads = pake.node.pusher._select(pool, remote, candidates)
+                self.assertEqual([(path, pool.path('foo.txt'), state['sha256'])], uploads)
+                ofstream = open(path, 'w')
+                ofstream.write('fooo')
+                ofstream.close()
+                pool.manifest.set(pool.path('foo.txt'), state)
+                uploads = pake.node.pusher._select(pool, remote, candidates)
+                self.assertEqual([pool.path('foo.txt')], [remotepath for path, remotepath, sha256 in uploads])
+            # files are compared with the manifest only, no listing is needed
+            self.assertEqual([], [c for c in server.commands if c.split()[0] in ('MLSD', 'NLST', 'SIZE', 'MDTM')])
+            pool.close()
+        # cleanup
+        os.remove(path)
+        helpers.rmnode(testdir)
+
+    def testSelectingFallsBackToSizeAndModificationTime(self):
+        helpers.gennode(testdir)
+        server = helpers.FakeFTPServer(mlsd=False).makedirs('/mirror')
+        paths = [os.path.join(testdir, name) for name in ['foo.txt', 'bar.txt', 'baz.txt', 'new.txt']]
+        for path in paths:
+            ofstream = open(path, 'w')
+            ofstream.write('foo')
+            ofstream.close()
+        mtime = os.path.getmtime(paths[0])
+        server.put('/mirror/foo.txt', b'foo', mtime=mtime + 60)
+        server.put('/mirror/bar.txt', b'fo', mtime=mtime + 60)
+        server.put('/mirror/baz.txt', b'foo', mtime=mtime - 60)
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            with pool.session() as remote:
+                candidates = [(path, pool.path(os.path.basename(path)), None) for path in paths]
+                pool.manifest.load(remote)
+                uploads = pake.node.pusher._select(pool, remote, candidates)
+            expected = ['/mirror/bar.txt', '/mirror/baz.txt', '/mirror/new.txt']
+            self.assertEqual(expected, [remotepath for path, remotepath, sha256 in uploads])
+            self.assertIn('SIZE /mirror/foo.txt', server.commands)
+            self.assertIn('MDTM /mirror/foo.txt', server.commands)
+            # file found on the mirror is recorded in the manifest
+            state = {'size': 3, 'sha256': pake.shared.filedigest(paths[0])}
+            self.assertEqual(state, pool.manifest.get('/mirror/foo.txt'))
+            self.assertEqual(None, pool.manifest.get('/mirror/bar.txt'))
+            pool.close()
+        # cleanup
+        for path in paths: os.remove(path)
+        helpers.rmnode(testdir)
+
+    def testManifestRecordsOnlyFilesUploadedSuccessfully(self):
+        helpers.gennode(testdir)
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        server.refused.add('/mirror/bar.txt')
+        paths = [os.path.join(testdir, name) for name in ['foo.txt', 'bar.txt']]
+        for path in paths:
+            ofstream = open(path, 'w')
+            ofstream.write('foo')
+            ofstream.close()
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=2)
+            with pool.session() as remote:
+                candidates = [(path, pool.path(os.path.basename(path)), None) for path in paths]
+                uploads = pake.node.pusher._select(pool, remote, candidates)
+            self.assertEqual({}, pool.manifest.files)
+            failed = pake.node.pusher._transfer(pool, uploads, log=lambda message: None)
+            self.assertEqual(['/mirror/bar.txt'], [remote for remote, e in failed])
+            self.assertEqual(['foo.txt'], list(pool.manifest.files))
+            self.assertEqual(b'foo', server.files['/mirror/foo.txt'])
+            pool.close()
+        # cleanup
+        for path in paths: os.remove(path)
+        helpers.rmnode(testdir)
+
+    def testFailedPushKeepsPreviousManifestEntries(self):
+        url = 'http://pake.example.com'
+        version = helpers.genpushable(testdir, url)
+        archive = 'packages/test/versions/{0}/build.tar.xz'.format(version)
+        previous = {archive: {'size': 1, 'sha256': '0' * 64}, 'old.txt': {'size': 2, 'sha256': '1' * 64}}
+        server = helpers.FakeFTPServer().put('/mirror/push-manifest.json', json.dumps(previous).encode('utf-8'))
+        server.refused.add('/mirror/' + archive)
+        # test logic
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            results = pake.node.pusher.pushall(test_node_root, [(url, 'user', 'pass')], progress=lambda *args: None)
+        self.assertIsInstance(results[0].exception, pake.errors.PushError)
+        manifest = json.loads(server.files['/mirror/push-manifest.json'].decode('utf-8'))
+        self.assertEqual(previous[archive], manifest[archive])
+        self.assertEqual(previous['old.txt'], manifest['old.txt'])
+        self.assertIn('meta.json', manifest)
+        self.assertIn('packages/test/versions/{0}/meta.json'.format(version), manifest)
+        # cleanup
+        helpers.rmnode(testdir)
+        helpers.rmnest(testdir)
+
+    def testUploadResumesFromPartialFileAfterDroppedConnection(self):
+        path = os.path.join(testdir, 'big.bin')
+        data = os.urandom(10000)
+        ofstream = open(path, 'wb')
+        ofstream.write(data)
+        ofstream.close()
+        sha256 = pake.shared.filedigest(path)
+        partial = '/mirror/big.bin.{0}.part'.format(sha256[:16])
+        # STOR is repeated after REST, or the rest of the file is appended with APPE
+        for rest, resume, stored in [(True, 'REST 4000', 2), (False, 'APPE {0}'.format(partial), 1)]:
+            server = helpers.FakeFTPServer(rest=rest).makedirs('/mirror')
+            server.drops['/mirror/big.bin'] = [4000]
+            messages = []
+            with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), \
+                    unittest.mock.patch.object(pake.node.pusher, 'RESUMABLE', 1024), \
+                    unittest.mock.patch.object(pake.node.pusher.time, 'sleep') as sleep:
+                pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+                pake.node.pusher._send(pool, path, '/mirror/big.bin', sha256, log=messages.append)
+                pool.close()
+            self.assertEqual(data, server.files['/mirror/big.bin'])
+            self.assertNotIn(partial, server.files)
+            self.assertEqual(stored, server.count('STOR {0}'.format(partial)))
+            self.assertEqual(1, server.count(resume))
+            self.assertEqual(1, len(sleep.call_args_list))
+            self.assertIn('+ pake: debug: uploaded "/mirror/big.bin" (resumed at byte 4000)', messages)
+        # cleanup
+        os.remove(path)
+
+    def testSmallFilesAreSentAtOnce(self):
+        path = os.path.join(testdir, 'small.bin')
+        data = os.urandom(10000)
+        ofstream = open(path, 'wb')
+        ofstream.write(data)
+        ofstream.close()
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        server.drops['/mirror/small.bin'] = [4000]
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), \
+                unittest.mock.patch.object(pake.node.pusher.time, 'sleep'):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            pake.node.pusher._send(pool, path, '/mirror/small.bin', pake.shared.filedigest(path), log=lambda m: None)
+            pool.close()
+        self.assertEqual(data, server.files['/mirror/small.bin'])
+        self.assertEqual(2, server.count('STOR /mirror/small.bin'))
+        self.assertEqual([], [c for c in server.commands if c.split()[0] in ('SIZE', 'REST', 'APPE', 'RNFR')])
+        # cleanup
+        os.remove(path)
+
+    def testUploadsAreRetriedWithBackoff(self):
+        path = os.path.join(testdir, 'foo.txt')
+        ofstream = open(path, 'w')
+        ofstream.write('foo')
+        ofstream.close()
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        server.drops['/mirror/foo.txt'] = [0] * (pake.node.pusher.RETRIES + 1)
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), \
+                unittest.mock.patch.object(pake.node.pusher.time, 'sleep') as sleep:
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            self.assertRaises(ConnectionResetError, pake.node.pusher._send, pool, path, '/mirror/foo.txt', '0' * 64,
+                              log=lambda message: None)
+            # local errors are not retried
+            self.assertRaises(IsADirectoryError, pake.node.pusher._send, pool, testdir, '/mirror/foo', '0' * 64,
+                              log=lambda message: None)
+            pool.close()
+        self.assertEqual(pake.node.pusher.RETRIES + 1, server.count('STOR /mirror/foo.txt'))
+        delays = [pake.node.pusher.BACKOFF * 2 ** i for i in range(pake.node.pusher.RETRIES)]
+        self.assertEqual(delays, [args[0] for args, kwargs in sleep.call_args_list])
+        # cleanup
+        os.remove(path)
+
+    def testStalePartialUploadsAreRemoved(self):
+        path = os.path.join(testdir, 'big.bin')
+        ofstream = open(path, 'wb')
+        ofstream.write(os.urandom(10000))
+        ofstream.close()
+        server = helpers.FakeFTPServer().put('/mirror/big.bin.0000000000000000.part', b'old')
+        server.put('/mirror/other.bin.0000000000000000.part', b'other')
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect), \
+                unittest.mock.patch.object(pake.node.pusher, 'RESUMABLE', 1024):
+            pool = pake.node.pusher.Pool('ftp.example.com', 'user', 'pass', cwd='mirror', size=1)
+            pake.node.pusher._send(pool, path, '/mirror/big.bin', pake.shared.filedigest(path), log=lambda m: None)
+            self.assertEqual(['big.bin', 'other.bin.0000000000000000.part'], sorted(pool.listings.get('/mirror')))
+            pool.close()
+        self.assertEqual(['/mirror/big.bin', '/mirror/other.bin.0000000000000000.part'], sorted(server.files))
+        # cleanup
+        os.remove(path)
+
+    def testFailedPackageFilesHoldBackVersionsIndex(self):
+        url = 'http://pake.example.com'
+        version = helpers.genpushable(testdir, url)
+        archive = '/mirror/packages/test/versions/{0}/build.tar.xz'.format(version)
+        server = helpers.FakeFTPServer().makedirs('/mirror')
+        server.refused.add(archive)
+        # test logic
+        with unittest.mock.patch.object(pake.node.pusher, 'FTPPusher', server.connect):
+            results = pake.node.pusher.pushall(test_node_root, [(url, 'user', 'pass')], progress=lambda *args: None)
+            self.assertIsInstance(results[0].exception, pake.errors.PushError)
+            self.assertNotIn('/mirror/packages/test/versions.json', server.files)
+            self.assertIn('/mirror/packages/test/versions/{0}/meta.json'.format(version), server.files)
+            self.assertIn('/mirror/packages.json', server.files)
+            server.refused.clear()
+            results = pake.node.pusher.pushall(test_node_root, [(url, 'user', 'pass')], progress=lambda *args: None)
+            self.assertEqual([True], [r.ok for r in results])
+        self.assertIn(archive, server.files)
+        self.assertIn('/mirror/packages/test/versions.json', server.files)
+        # cleanup
+        helpers.rmnode(testdir)
+        helpers.rmnest(testdir)
+
     def testPushingToNode(self):
         helpers.gennode(testdir)
         helpers.gennest(testdir)
@@ -508,6 +1211,21 @@ class NestConfigurationTests(unittest.TestCase):
         # cleanup
         helpers.rmnest(testdir)
 
+    def testUpdatingCachedDependencyCopiesOnlyItsValue(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Dependencies(test_nest_root).set(name='foo', min='0.2.4').set(name='bar', min='2.4.8').write()
+        # test logic
+        cached = pake.config.nest.Dependencies(test_nest_root)
+        deps = pake.config.nest.Dependencies(test_nest_root).update(name='foo', min='0.4.8')
+        self.assertEqual({'min': '0.2.4'}, cached.get('foo'))
+        self.assertEqual({'min': '0.2.4'}, pake.config.nest.Dependencies(test_nest_root).get('foo'))
+        self.assertEqual({'min': '0.4.8'}, deps.get('foo'))
+        self.assertIs(cached.get('bar'), deps.get('bar'))
+        deps.update(name='bar', max='4.8.16')
+        self.assertEqual({'min': '2.4.8'}, cached.get('bar'))
+        # cleanup
+        helpers.rmnest(testdir)
+
     def testGettingDependencyData(self):
         helpers.gennest(testdir)
         # test logic
@@ -562,6 +1280,36 @@ class NestConfigurationTests(unittest.TestCase):
         # cleanup
         helpers.rmnest(testdir)
 
+    def testAddingManyFilesSkipsDuplicates(self):
+        helpers.gennest(testdir)
+        # test logic
+        pake.config.nest.Files(test_nest_root).add(path='./pake/__init__.py').write()
+        paths = ['pake/__init__.py', './pake/shared.py', './pake/../pake/shared.py', './pake/errors.py']
+        pake.config.nest.Files(test_nest_root).extend(paths).write()
+        desired = ['./pake/__init__.py', './pake/shared.py', './pake/errors.py']
+        self.assertEqual(desired, list(pake.config.nest.Files(test_nest_root)))
+        self.assertTrue(pake.config.nest.Files(test_nest_root).has('pake/errors.py'))
+        files = pake.config.nest.Files(test_nest_root)
+        self.assertRaises(pake.errors.NotAFileError, files.extend, ['./pake/records.py', './pake'])
+        self.assertEqual(desired, list(pake.config.nest.Files(test_nest_root)))
+        # cleanup
+        helpers.rmnest(testdir)
+
+    def testRemovingOneOfDuplicatedFilesKeepsTheOther(self):
+        helpers.gennest(testdir)
+        # older versions could list the same file under different paths
+        ofstream = open(os.path.join(test_nest_root, 'files.json'), 'w')
+        ofstream.write(json.dumps(['./pake/shared.py', 'pake/shared.py']))
+        ofstream.close()
+        # test logic
+        files = pake.config.nest.Files(test_nest_root)
+        self.assertTrue(files.has('pake/shared.py'))
+        files.remove('pake/shared.py')
+        self.assertTrue(files.has('./pake/shared.py'))
+        self.assertEqual(['./pake/shared.py'], list(files.extend(['./pake/shared.py'])))
+        # cleanup
+        helpers.rmnest(testdir)
+
 
 class NestReleaseBuildingTests(unittest.TestCase):
     def testPackageBuildCreatesAllNecessaryFiles(self):
@@ -602,12 +1350,55 @@ class NestReleaseBuildingTests(unittest.TestCase):
         # cleanup
         helpers.rmnest(testdir)
 
+    def testScanningDirectoryWithIgnorePatterns(self):
+        src = os.path.join(testdir, 'src')
+        for d in ['a/build', 'build', 'b/__pycache__', 'b/c']: os.makedirs(os.path.join(src, d))
+        for f in ['x.py', 'x.pyc', 'a/y.py', 'a/y.swp', 'a/build/z.py', 'build/z.py',
+                  'b/__pycache__/w.py', 'b/c/v.py', 'b/c/notes.txt']:
+            open(os.path.join(src, f), 'w').close()
+        # test logic
+        found = list(pake.nest.scanner.scan(src, avoid=['__pycache__'], extensions=['pyc'],
+                                            ignore=['*.swp', '/build/', 'b/**/*.txt']))
+        desired = ['x.py', 'a/y.py', 'a/build/z.py', 'b/c/v.py']
+        self.assertEqual(sorted([os.path.join(src, f) for f in desired]), sorted(found))
+        self.assertEqual([os.path.join(src, 'x.py'), os.path.join(src, 'x.pyc')],
+                         list(pake.nest.scanner.scan(src, recursive=False)))
+        # cleanup
+        shutil.rmtree(src)
+
+    def testBuildingWithGlobPatterns(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Meta(test_nest_root).set('name', 'test').write()
+        src = os.path.join(testdir, 'src')
+        for d in ['a/__pycache__', 'skip', 'docs']: os.makedirs(os.path.join(src, d))
+        for f in ['x.py', 'a/y.py', 'a/__pycache__/y.py', 'skip/z.py', 'docs/README', 'docs/notes.txt']:
+            open(os.path.join(src, f), 'w').close()
+        files = pake.config.nest.Files(test_nest_root).extend(['./pake/__init__.py'])
+        files.include('src/**/*.py').include('src/docs/')
+        files.exclude('__pycache__/').exclude('src/skip/').exclude('*.txt').write()
+        # test logic
+        files = pake.config.nest.Files(test_nest_root)
+        self.assertEqual(['./pake/__init__.py'], list(files))
+        self.assertEqual([('include', 'src/docs/'), ('exclude', '*.txt')], [files.patterns()[1], files.patterns()[-1]])
+        self.assertRaises(FileExistsError, files.include, 'src/**/*.py')
+        desired = ['pake/__init__.py'] + [os.path.normpath(os.path.join(src, f))
+                                          for f in ['a/y.py', 'docs/README', 'x.py']]
+        self.assertEqual(desired, files.expand(testdir))
+        self.assertEqual(['./pake/__init__.py'], list(files.removepattern('src/**/*.py').removepattern('src/docs/')))
+        pake.nest.package.build(test_nest_root, '0.1.0')
+        test_pkg = tarfile.open(os.path.join(test_nest_root, 'versions', '0.1.0', 'build.tar.xz'), 'r:xz')
+        self.assertEqual(sorted(desired), test_pkg.getnames())
+        test_pkg.close()
+        # cleanup
+        shutil.rmtree(src)
+        helpers.rmnest(testdir)
+
     def testIfArchieveContainsAllRequiredFiles(self):
         helpers.gennest(testdir)
         desired = ['./pake/__init__.py', './pake/shared.py']
         version = helpers.buildTestPackage(path=test_nest_root, version='2.4.8', files=desired, directories=[])
         # test logic
-        test_pkg = tarfile.TarFile(os.path.join(test_nest_root, 'versions', version, 'build.tar.xz'), 'r')
+        test_pkg = tarfile.open(os.path.join(test_nest_root, 'versions', version, 'build.tar.xz'), 'r:xz')
         names = test_pkg.getnames()
         test_pkg.close()
         # create list of files we expect to be included
@@ -629,9 +1420,161 @@ class NestReleaseBuildingTests(unittest.TestCase):
         # cleanup
         helpers.rmnest(testdir)
 
+    def testBuildingWithOtherCodecRecordsArchiveName(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Meta(test_nest_root).set('name', 'test').write()
+        pake.nest.package.addfile(test_nest_root, './pake/__init__.py')
+        # test logic
+        self.assertRaises(pake.errors.PackageError, pake.nest.package.build, test_nest_root, '0.1.0', codec='foo')
+        self.assertRaises(pake.errors.PackageError, pake.nest.package.build, test_nest_root, '0.1.0',
+                          codec='gzip', level='9e')
+        self.assertFalse(os.path.isdir(os.path.join(test_nest_root, 'versions', '0.1.0')))
+        pake.nest.package.build(test_nest_root, '0.1.0', codec='gzip', level=1)
+        releasepath = os.path.join(test_nest_root, 'versions', '0.1.0')
+        meta = pake.config.nest.Meta(releasepath)
+        self.assertEqual('gzip', meta.get('build')['codec'])
+        self.assertEqual(os.path.getsize(os.path.join(releasepath, 'build.tar.gz')), meta.get('build')['size'])
+        self.assertEqual('build.tar.gz', pake.nest.compress.getarchive(meta))
+        test_pkg = tarfile.open(os.path.join(releasepath, 'build.tar.gz'), 'r:gz')
+        self.assertEqual(['pake/__init__.py'], test_pkg.getnames())
+        test_pkg.close()
+        self.assertEqual(9 | lzma.PRESET_EXTREME, pake.nest.compress.getcodec('xz').parselevel('9e'))
+        self.assertRaises(TypeError, pake.nest.compress.Codec)
+        # cleanup
+        helpers.rmnest(testdir)
+
+    def testBuildsAreReproducible(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Meta(test_nest_root).set('name', 'test').write()
+        pake.config.nest.Files(test_nest_root).extend(['./pake/shared.py', './pake/__init__.py']).write()
+        # test logic
+        pake.nest.package.build(test_nest_root, '0.1.0', threads=1)
+        os.utime('./pake/shared.py')
+        pake.nest.package.build(test_nest_root, '0.1.1', threads=4)
+        first = pake.config.nest.Meta(os.path.join(test_nest_root, 'versions', '0.1.0')).get('build')
+        second = pake.config.nest.Meta(os.path.join(test_nest_root, 'versions', '0.1.1')).get('build')
+        self.assertEqual(first['sha256'], second['sha256'])
+        archive = os.path.join(test_nest_root, 'versions', '0.1.0', 'build.tar.xz')
+        self.assertEqual(pake.shared.filedigest(archive), first['sha256'])
+        test_pkg = tarfile.open(os.path.join(test_nest_root, 'versions', '0.1.0', 'build.tar.xz'), 'r:xz')
+        self.assertEqual(['pake/__init__.py', 'pake/shared.py'], test_pkg.getnames())
+        self.assertEqual([(0, 0, '', 0)], list(set([(i.uid, i.gid, i.uname, i.mtime) for i in test_pkg.getmembers()])))
+        test_pkg.close()
+        # cleanup
+        helpers.rmnest(testdir)
+
+    def testIncrementalBuildsReuseCache(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Meta(test_nest_root).set('name', 'test').write()
+        os.mkdir(os.path.join(testdir, 'src'))
+        paths = [os.path.join(testdir, 'src', 'file{0}.txt'.format(i)) for i in range(64)]
+        for i, path in enumerate(paths):
+            ofstream = open(path, 'w')
+            ofstream.write('file {0}\n'.format(i) * 12000)
+            ofstream.close()
+        pake.config.nest.Files(test_nest_root).extend(paths).write()
+        cachedir = os.path.join(test_nest_root, pake.nest.incremental.CACHEDIR)
+        # test logic
+        # level 0 uses the smallest blocks, so the archive is made of several runs
+        pake.nest.package.build(test_nest_root, '0.1.0', level=0, threads=2)
+        blobs = sorted(os.listdir(cachedir))
+        self.assertTrue(len(blobs) > 1)
+        ofstream = open(paths[7], 'a')
+        ofstream.write('changed\n')
+        ofstream.close()
+        pake.nest.package.build(test_nest_root, '0.1.1', level=0, threads=2)
+        self.assertEqual(len(blobs) - 1, len(set(blobs) & set(os.listdir(cachedir))))
+        pake.nest.package.build(test_nest_root, '0.1.2', level=0, threads=2, cache=False)
+        pake.nest.package.build(test_nest_root, '0.1.3', level=0, threads=2)
+        archives = [os.path.join(test_nest_root, 'versions', v, 'build.tar.xz') for v in ['0.1.1', '0.1.2', '0.1.3']]
+        digests = [pake.config.nest.Meta(os.path.dirname(a)).get('build')['sha256'] for a in archives]
+        self.assertEqual(digests[0], digests[2])
+        self.assertNotEqual(digests[0], digests[1])
+        data = []
+        for archive in archives:
+            ifstream = open(archive, 'rb')
+            data.append(lzma.decompress(ifstream.read()))
+            ifstream.close()
+        self.assertEqual(1, len(set(data)))
+        test_pkg = tarfile.open(archives[0], 'r:xz')
+        self.assertEqual(sorted([os.path.normpath(p) for p in paths]), test_pkg.getnames())
+        self.assertEqual(b'file 7\n' * 12000 + b'changed\n', test_pkg.extractfile(os.path.normpath(paths[7])).read())
+        test_pkg.close()
+        # cleanup
+        shutil.rmtree(os.path.join(testdir, 'src'))
+        helpers.rmnest(testdir)
+
+    def testBuildWritesManifest(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Meta(test_nest_root).set('name', 'test').write()
+        files = ['./pake/shared.py', './pake/__init__.py', './pake/errors.py']
+        pake.config.nest.Files(test_nest_root).extend(files).write()
+        # test logic
+        pake.nest.package.build(test_nest_root, '0.1.0')
+        releasepath = os.path.join(test_nest_root, 'versions', '0.1.0')
+        manifest = pake.config.nest.Manifest(releasepath)
+        self.assertEqual('build.tar.xz', manifest.getarchive())
+        self.assertEqual(['pake/__init__.py', 'pake/errors.py', 'pake/shared.py'], [i['path'] for i in manifest])
+        ifstream = open(os.path.join(releasepath, 'build.tar.xz'), 'rb')
+        data = lzma.decompress(ifstream.read())
+        ifstream.close()
+        for entry in manifest:
+            content = data[entry['offset']:entry['offset']+entry['size']]
+            self.assertEqual(os.path.getsize(entry['path']), entry['size'])
+            self.assertEqual(hashlib.sha256(content).hexdigest(), entry['sha256'])
+            self.assertEqual(0o644, entry['mode'])
+        self.assertEqual(manifest.get('./pake/errors.py'), list(manifest)[1])
+        # cleanup
+        helpers.rmnest(testdir)
+
+    def testBuildingDeltaFromPreviousVersion(self):
+        helpers.gennest(testdir)
+        pake.config.nest.Meta(test_nest_root).set('name', 'test').write()
+        os.mkdir(os.path.join(testdir, 'src'))
+        paths = dict([(name, os.path.join(testdir, 'src', name)) for name in ['a', 'b', 'c', 'd']])
+        for name in ['a', 'b', 'c']:
+            ofstream = open(paths[name], 'w')
+            ofstream.write(name)
+            ofstream.close()
+        pake.config.nest.Files(test_nest_root).extend([paths['a'], paths['b'], paths['c']]).write()
+        pake.nest.package.build(test_nest_root, '0.1.0')
+        # test logic
+        for name in ['b', 'd']:
+            ofstream = open(paths[name], 'w')
+            ofstream.write(name * 2)
+            ofstream.close()
+        pake.config.nest.Files(test_nest_root).remove(paths['c']).add(paths['d']).write()
+        pake.nest.package.build(test_nest_root, '0.1.1', delta=True)
+        releasepath = os.path.join(test_nest_root, 'versions', '0.1.1')
+        delta = pake.config.nest.Meta(releasepath).get('build')['delta']
+        self.assertEqual('0.1.0', delta['from'])
+        self.assertEqual('delta-from-0.1.0.tar.xz', delta['archive'])
+        self.assertEqual(pake.shared.filedigest(os.path.join(releasepath, delta['archive'])), delta['sha256'])
+        test_pkg = tarfile.open(os.path.join(releasepath, delta['archive']), 'r:xz')
+        names = [os.path.normpath(paths[name]) for name in ['b', 'd']]
+        self.assertEqual([pake.nest.delta.MEMBER] + names, test_pkg.getnames())
+        info = json.loads(test_pkg.extractfile(pake.nest.delta.MEMBER).read().decode('utf-8'))
+        self.assertEqual([os.path.normpath(paths['c'])], info['removed'])
+        test_pkg.close()
+        # cleanup
+        shutil.rmtree(os.path.join(testdir, 'src'))
+        helpers.rmnest(testdir)
+
+    def testParallelCompressionProducesValidXZ(self):
+        data = os.urandom(64 * 1024) * 8
+        for threads in [1, 4]:
+            ofstream = io.BytesIO()
+            with pake.nest.compress.XZWriter(ofstream, threads=threads, preset=1, blocksize=100 * 1024) as writer:
+                for i in range(0, len(data), 3000): writer.write(data[i:i+3000])
+            self.assertEqual(data, lzma.decompress(ofstream.getvalue()))
+        ofstream = io.BytesIO()
+        pake.nest.compress.XZWriter(ofstream, threads=4).close()
+        self.assertEqual(b'', lzma.decompress(ofstream.getvalue()))
+
 
 # Wrapper class
-class Suite(NodeManagerTests, NodeConfigurationTests, NodePackagesTests, NodePushingTests, NestManagerTests, NestConfigurationTests, NestReleaseBuildingTests):
+class Suite(NodeManagerTests, NodeConfigurationTests, NodeSessionTests, NodeSQLiteStorageTests, NodePackagesTests,
+            NodePushingTests, NestManagerTests, NestConfigurationTests, NestReleaseBuildingTests):
     pass
 
 if __name__ == '__main__':
@@ -770,7 +770,7 @@ class NestReleaseBuildingTests(unittest.TestCase):
         runner = pake.transactions.runner.Runner(root=testdir, requests=reqs)
         # test logic
         runner.run()
-        test_pkg = tarfile.TarFile(os.path.join(test_nest_root, 'versions', version, 'build.tar.xz'), 'r')
+        test_pkg = tarfile.open(os.path.join(test_nest_root, 'versions', version, 'build.tar.xz'), 'r:xz')
         names = test_pkg.getnames()
         test_pkg.close()
         # create list of files we expect to be included
@@ -64,7 +64,6 @@ import getpass
 import os
 import sys
 import urllib
-import warnings
 
 import clap
 import pake
@@ -213,8 +212,13 @@ elif str(ui) == 'files':
 
     """Here are options local to *files* mode and not its sub-modes, e.g. --list.
     """
+    if '--include' in ui:
+        files.include(ui.get('--include')).write()
+    if '--exclude' in ui:
+        files.exclude(ui.get('--exclude')).write()
     if '--list' in ui:
         for i in files: print(' * {0}'.format(i))
+        for kind, pattern in files.patterns(): print(' {0} {1}'.format(('+' if kind == 'include' else '-'), pattern))
 
     if str(ui) == 'add':
         """If directories are found on arguments list they are added to file list
@@ -222,19 +226,6 @@ elif str(ui) == 'files':
         Files inside these directories are added unless --not-recursive option is passed in which
         case only directories are added.
         """
-        def scan(directory):
-            """Recursively scan the directory and return its contents as list.
-            """
-            files = []
-            for i in os.listdir(directory):
-                if os.path.isfile(os.path.join(directory, i)):
-                    files.append(os.path.join(directory,i))
-                elif os.path.isdir(os.path.join(directory, i)):
-                    files.extend(scan(os.path.join(directory, i)))
-                else:
-                    warnings.warn('{0} is not a file or directory: dropped'.format(i))
-            return files
-
         candidates = []
         accepted = []
         dropped = []
@@ -242,7 +233,7 @@ elif str(ui) == 'files':
         # create list of candidate files
         for i in ui.arguments:
             if os.path.isfile(i): candidates.append(i)
-            elif os.path.isdir(i): candidates.extend(scan(i))
+            elif os.path.isdir(i): candidates.extend(pake.nest.scanner.scan(i))
 
         if '--regexp' in ui:
             # filter them according to given regular expression(s)
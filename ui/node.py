@@ -23,6 +23,7 @@ Copyright Marek Marecki (c) 2013"""
 import getpass
 import os
 import sys
+import time
 import urllib
 import warnings
 
@@ -333,29 +334,35 @@ elif str(ui) == 'push':
     # reports about push status
     print()
 
-    for i, url in enumerate(urls):
-        # enumeration is required to get index for credentials
-        # they are stored in a list synced with list of URLs
-        if credentials[i]:
-            print('* pushing to mirror {0}...'.format(url))
-            username, password = credentials[i]
-            try:
-                pake.node.pusher.push(root, url, username, password, reupload=('--reupload' in ui))
-                message = '* pushing to mirror {0}: OK'.format(url)
-            except KeyboardInterrupt:
-                message = '* pushing to mirror {0}: cancelled by user'.format(url)
-            except Exception as e:
-                if '--debug' in ui:
-                    # if running with --debug option reraise the exception to
-                    # provide stack trace and debug info
-                    message = '* pushing to mirror {0}: failed: showing debug trace'.format(url)
-                    print()
-                    raise
-                else:
-                    # otherwise, silence the exception and just show error message
-                    message = '* pushing to mirror {0}: failed: {1} (cause: {2})'.format(url, e, str(type(e))[8:-2])
-            finally:
-                print(message)
+    # mirrors are pushed concurrently, each in its own thread
+    pushes = [(url,) + tuple(c) for url, c in zip(urls, credentials) if c]
+    start = time.time()
+    try:
+        results = pake.node.pusher.pushall(root, pushes, reupload=('--reupload' in ui),
+                                           jobs=(ui.get('--jobs') if '--jobs' in ui else None),
+                                           connections=(ui.get('--connections') if '--connections' in ui else 4),
+                                           prefetch=('--prefetch' in ui))
+    except KeyboardInterrupt:
+        print('pake: push cancelled by user')
+        exit(1)
+    pake.node.pusher.report(results, wall=(time.time() - start))
+    failed = [result for result in results if not result.ok]
+    if failed and '--debug' in ui:
+        # if running with --debug option reraise the exception to
+        # provide stack trace and debug info
+        print('* pushing to mirror {0}: failed: showing debug trace'.format(failed[0].url))
+        raise failed[0].exception
+elif str(ui) == 'build':
+    """This mode is used to build packages of all nests registered in the node.
+    Nests are built in parallel and version of every nest is taken from its metadata.
+    """
+    names = ([ui.get('--only')] if '--only' in ui else None)
+    start = time.time()
+    results = pake.node.builder.build(root, names=names, jobs=(ui.get('--jobs') if '--jobs' in ui else None),
+                                      codec=(ui.get('--codec') if '--codec' in ui else 'xz'),
+                                      level=(ui.get('--level') if '--level' in ui else None),
+                                      cache=('--no-cache' not in ui), delta=('--delta' in ui))
+    pake.node.builder.report(results, wall=(time.time() - start))
 elif str(ui) == '':
     """Local options of top mode.
     """